@@ -1,52 +1,40 @@
 import streamlit as st
-import cv2
-import numpy as np
-from PIL import Image
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import random
-import os
-import plotly.express as px
-from emotion_utils.detector import EmotionDetector
-import hashlib
+import io
+import time
+from emotion_utils.cache import ResultCache
+from emotion_utils.config import get_settings
+from emotion_utils.history import open_history_store
+from emotion_utils.jobs import JobQueue
+from emotion_utils.metrics import METRICS
+from emotion_utils.users import UserStore
+
+# All tunables (backend, image sizes, worker counts, ...) come from environment
+# variables read once into this frozen object; see emotion_utils/config.py
+settings = get_settings()
+
+# cv2, numpy, pandas, plotly and the detector (which pulls in TensorFlow) are
+# imported where first used so the login page renders without waiting on them.
 
 # ----------------- User Authentication -----------------
+@st.cache_resource
+def get_user_store():
+    return UserStore("users.csv", iterations=settings.password_iterations)
+
 def authenticate(username, password):
     """Check if username and password match"""
     try:
-        if os.path.exists("users.csv"):
-            users = pd.read_csv("users.csv")
-            user_record = users[users["username"] == username]
-            if not user_record.empty:
-                hashed_password = hashlib.sha256(password.encode()).hexdigest()
-                return user_record["password"].values[0] == hashed_password
-        return False
-    except:
+        return get_user_store().authenticate(username, password)
+    except Exception as e:
+        print(f"Login error: {e}")
         return False
 
 def register_user(username, password):
     """Register new user"""
     try:
-        # Check if username already exists
-        if os.path.exists("users.csv"):
-            users = pd.read_csv("users.csv")
-            if username in users["username"].values:
-                return False
-        
-        # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        
-        # Create new user record
-        new_user = pd.DataFrame([[username, hashed_password]], 
-                              columns=["username", "password"])
-        
-        # Append to existing users or create new file
-        if os.path.exists("users.csv"):
-            new_user.to_csv("users.csv", mode='a', header=False, index=False)
-        else:
-            new_user.to_csv("users.csv", index=False)
-            
-        return True
+        return get_user_store().register(username, password)
     except Exception as e:
         print(f"Registration error: {e}")
         return False
@@ -60,25 +48,175 @@ st.set_page_config(
 )
 
 @st.cache_resource
+def get_detection_cache():
+    # Set DETECTION_CACHE_DIR to keep results across restarts
+    return ResultCache(max_entries=settings.cache_size, disk_dir=settings.cache_dir)
+
+def build_detector():
+    from emotion_utils.detector import EmotionDetector
+
+    # With a worker pool the local detector only draws, so skip loading models here
+    detector = EmotionDetector(preload=settings.inference_workers == 0)
+    if detector.load_times:
+        print("Detector load times: " + ", ".join(f"{k} {v:.2f}s" for k, v in detector.load_times.items()))
+    return detector
+
+@st.cache_resource
+def get_detector_loader():
+    """Start loading the detector on a background thread as soon as the server starts"""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-load")
+    return executor.submit(build_detector)
+
 def get_detector():
-    return EmotionDetector()
+    """The loaded detector, waiting for the background load if it is still running"""
+    return get_detector_loader().result()
+
+@st.cache_resource
+def get_inference_pool():
+    if settings.inference_workers <= 0:
+        return None
+    from emotion_utils.workers import InferencePool
+
+    # Workers read the same settings, so only pool-level options are passed
+    pool = InferencePool(workers=settings.inference_workers,
+                         timeout=settings.inference_timeout)
+    # Spawn and load every worker at server start instead of inside the first uploads
+    for future in pool.warm_up():
+        future.add_done_callback(lambda f: f.exception() and print(f"Worker warm-up error: {f.exception()}"))
+    return pool
 
-detector = get_detector()
+get_detector_loader()
+get_inference_pool()
 
-def save_history(username, emotions, confidences, location="Unknown"):
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+@st.cache_resource
+def get_job_queue():
+    # Results are collected into the session and forgotten as soon as they are
+    # read; only results nobody came back for are dropped, after ten minutes
+    return JobQueue(workers=settings.job_workers, abandon_after=600)
+
+job_queue = get_job_queue()
+
+def run_detection(img):
+    """Detect emotions in the worker pool when configured, otherwise inline"""
+    inference_pool = get_inference_pool()
+    if inference_pool is not None:
+        return inference_pool.detect_emotions(img)
+    return get_detector().detect_emotions(img)
+
+@st.cache_resource
+def get_history_store():
+    # HISTORY_BACKEND=parquet stores per-user Parquet partitions under history_parquet/
+    return open_history_store(backend=settings.history_backend)
+
+history_store = get_history_store()
+
+@st.cache_resource
+def get_face_index():
+    from emotion_utils.face_index import UserFaceIndexes
+
+    # One SFace embedding per saved face, kept per user and linked to history by (timestamp, face)
+    return UserFaceIndexes(settings.face_index_path, 128)
+
+def find_earlier_sightings(embeddings, username):
+    """For each embedding, the earlier upload timestamps of this user showing the same face"""
+    face_index = get_face_index().for_user(username)
+    sightings = []
+    for vector in embeddings:
+        matches = face_index.search(vector, k=None, min_similarity=settings.same_face_similarity)
+        sightings.append(sorted({meta["timestamp"] for _, _, meta in matches}))
+    return sightings
+
+def save_history(username, emotions, confidences, location="Unknown", timestamp=None, embeddings=None):
+    now = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     records = []
     for i, (emo, conf) in enumerate(zip(emotions, confidences)):
-        records.append([username, location, emo, conf, now])
-    
-    df = pd.DataFrame(records, columns=["username", "Location", "Emotion", "Confidence", "timestamp"])
+        records.append((username, location, emo, float(conf), now))
+
+    # Runs on a background thread, so errors go to the log rather than the page
     try:
-        if os.path.exists("history.csv"):
-            prev = pd.read_csv("history.csv")
-            df = pd.concat([prev, df])
-        df.to_csv("history.csv", index=False)
+        with METRICS.span("history_write"):
+            history_store.append(records)
     except Exception as e:
-        st.error(f"Failed to save history: {e}")
+        METRICS.inc("history_errors")
+        print(f"Failed to save history: {e}")
+        export_metrics()
+        return
+
+    # Only faces whose history rows were written are indexed; embeddings[i] is None for unembedded faces
+    faces = [(i, vector) for i, vector in enumerate(embeddings or []) if vector is not None]
+    if faces:
+        try:
+            get_face_index().for_user(username).add([vector for _, vector in faces],
+                                                    [{"username": username, "timestamp": now, "face": i}
+                                                     for i, _ in faces])
+        except Exception as e:
+            print(f"Failed to index faces: {e}")
+    export_metrics()
+
+def export_metrics():
+    # Set METRICS_FILE to have the Prometheus text refreshed after each upload
+    path = settings.metrics_file
+    if METRICS.enabled and path:
+        try:
+            METRICS.write(path)
+        except OSError as e:
+            print(f"Failed to write metrics: {e}")
+
+def process_upload(image_bytes, username):
+    """Background job: decode, detect and draw, then queue the history write"""
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from emotion_utils.preprocess import downscale, encode_image
+
+    try:
+        with METRICS.span("upload_total"):
+            # Keyed on the uploaded file itself, so a repeat upload is found before any decoding
+            cache = get_detection_cache()
+            with METRICS.span("cache_lookup"):
+                cache_key = cache.make_bytes_key(image_bytes, get_detector().settings_key())
+                cached = cache.get(cache_key)
+            METRICS.inc("cache_hits" if cached is not None else "cache_misses")
+            with METRICS.span("decode"):
+                image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            with METRICS.span("colour_conversion"):
+                img = np.array(image)
+                # Convert to BGR in place rather than allocating a second full-size array
+                cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=img)
+            if cached is None:
+                with METRICS.span("detection"):
+                    detections = run_detection(img)
+                cache.put(cache_key, detections)
+            else:
+                detections = cached
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            # Embeddings come from the detection step, and only for real faces;
+            # they are split off so the page and the cache-held dicts stay untouched
+            embeddings = [det.get("embedding") for det in detections]
+            detections = [{k: v for k, v in det.items() if k != "embedding"} for det in detections]
+            embedded = [i for i, vector in enumerate(embeddings) if vector is not None]
+            if embedded:
+                try:
+                    sightings = find_earlier_sightings([embeddings[i] for i in embedded], username)
+                    for i, seen in zip(embedded, sightings):
+                        detections[i]["seen_before"] = seen
+                except Exception as e:
+                    print(f"Face index error: {e}")
+            # Both previews are encoded once at display size; img is not needed afterwards
+            original_bytes = encode_image(downscale(img, settings.display_max_edge)[0])
+            detected_bytes = get_detector().render_detections(img, detections, in_place=True)
+    except Exception:
+        METRICS.inc("upload_errors")
+        raise
+    METRICS.inc("uploads")
+    if detections:
+        job_queue.run_in_background(save_history, username,
+                                    [d["emotion"] for d in detections],
+                                    [d["confidence"] for d in detections],
+                                    "Unknown", timestamp, embeddings)
+    else:
+        export_metrics()
+    return detections, original_bytes, detected_bytes
 
 def show_detection_guide():
     with st.expander("ℹ️ How Emotion Detection Works", expanded=False):
@@ -117,6 +255,9 @@ def sidebar_design(username):
         if st.sidebar.button("📜 History", key="history_button"):
             st.session_state.show_history = not st.session_state.get('show_history', False)
     
+    if METRICS.enabled and username in settings.admin_users:
+        show_metrics_panel()
+
     # Add logout button
     if st.sidebar.button("🚪 Logout"):
         st.session_state.logged_in = False
@@ -124,8 +265,30 @@ def sidebar_design(username):
         st.session_state.show_history = False
         st.rerun()
 
+def show_metrics_panel():
+    """Live stage timings and counters for admins"""
+    import pandas as pd
+
+    with st.sidebar.expander("📈 Metrics", expanded=False):
+        snap = METRICS.snapshot()
+        cache = get_detection_cache().stats()
+        st.caption(f"Cache: {cache['hits']} hits, {cache['misses']} misses, {cache['size']} entries")
+        if snap["counters"]:
+            st.dataframe(pd.Series(snap["counters"], name="count"), use_container_width=True)
+        if snap["summaries"]:
+            st.dataframe(pd.DataFrame(snap["summaries"]).T.round(4), use_container_width=True)
+        st.download_button("Download (Prometheus)", METRICS.to_prometheus(),
+                           file_name="metrics.prom", mime="text/plain")
+        if st.button("Refresh", key="metrics_refresh"):
+            st.rerun()
+
+HISTORY_PAGE_SIZE = 20
+
 def show_user_history(username):
     """Show user-specific history in main content area"""
+    import plotly.express as px
+    from emotion_utils.summary import summarize_sessions
+
     # Add back button in top right
     col1, col2 = st.columns([3, 1])
     with col1:
@@ -136,104 +299,94 @@ def show_user_history(username):
             st.rerun()
     
     try:
-        if os.path.exists("history.csv"):
-            df = pd.read_csv("history.csv")
-            if not df.empty:
-                # Check if username column exists, if not create empty dataframe
-                if 'username' not in df.columns:
-                    df['username'] = ""
-                
-                # Filter for current user only
-                user_df = df[df["username"] == username]
+        # Only one page of this user's sessions is read from the store
+        total_sessions = history_store.count_sessions(username)
+        page_count = max(1, -(-total_sessions // HISTORY_PAGE_SIZE))
+        page = 1
+        if page_count > 1:
+            page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count,
+                                   value=1, step=1, key="history_page")
+        user_df = history_store.load_page_frame(username, HISTORY_PAGE_SIZE, (page - 1) * HISTORY_PAGE_SIZE)
+        
+        if not user_df.empty:
+            # Group by timestamp and aggregate emotions, keeping newest first
+            grouped, emotion_counts = summarize_sessions(user_df)
+            
+            # Add index starting from 1
+            grouped.index = grouped.index + 1
+            
+            # Rename timestamp to Time for display
+            grouped_display = grouped.rename(columns={"timestamp": "Time"})
+            
+            # Display table with checkboxes in last column
+            st.markdown("**📝 Records**")
+            
+            # Initialize selection state if not exists
+            if 'select_all_state' not in st.session_state:
+                st.session_state.select_all_state = False
+            
+            # Add select column with current selection state
+            grouped_display['Select'] = st.session_state.select_all_state
+            
+            # Display non-editable table with checkboxes
+            edited_df = st.data_editor(
+                grouped_display[["Location", "Emotion", "Time", "Select"]],
+                disabled=["Location", "Emotion", "Time"],
+                hide_index=True,
+                use_container_width=True
+            )
+            
+            # Add select all and delete buttons on the right
+            col1, col2 = st.columns([4, 1])
+            with col2:
+                select_all = st.checkbox("Select All", key="select_all", value=st.session_state.select_all_state)
+                if select_all != st.session_state.select_all_state:
+                    st.session_state.select_all_state = select_all
+                    st.rerun()
                 
-                if not user_df.empty:
-                    # Group by timestamp and aggregate emotions
-                    grouped = user_df.groupby('timestamp').agg({
-                        'Location': 'first',
-                        'Emotion': lambda x: ', '.join([f"{x.tolist().count(e)} {e}" for e in set(x)]),
-                        'timestamp': 'first'
-                    }).reset_index(drop=True)
-                    
-                    # Add index starting from 1
-                    grouped.index = grouped.index + 1
-                    
-                    # Rename timestamp to Time for display
-                    grouped_display = grouped.rename(columns={"timestamp": "Time"})
-                    
-                    # Display table with checkboxes in last column
-                    st.markdown("**📝 Records**")
-                    
-                    # Initialize selection state if not exists
-                    if 'select_all_state' not in st.session_state:
-                        st.session_state.select_all_state = False
-                    
-                    # Add select column with current selection state
-                    grouped_display['Select'] = st.session_state.select_all_state
-                    
-                    # Display non-editable table with checkboxes
-                    edited_df = st.data_editor(
-                        grouped_display[["Location", "Emotion", "Time", "Select"]],
-                        disabled=["Location", "Emotion", "Time"],
-                        hide_index=True,
-                        use_container_width=True
-                    )
-                    
-                    # Add select all and delete buttons on the right
-                    col1, col2 = st.columns([4, 1])
-                    with col2:
-                        select_all = st.checkbox("Select All", key="select_all", value=st.session_state.select_all_state)
-                        if select_all != st.session_state.select_all_state:
-                            st.session_state.select_all_state = select_all
+                if st.button("🗑️ Delete", key="delete_button"):
+                    # Get indices of selected rows
+                    selected_indices = edited_df.index[edited_df['Select']].tolist()
+                    if selected_indices:
+                        # Safely get the timestamps to delete
+                        try:
+                            # Stored as "%Y-%m-%d %H:%M:%S" text, which is also how datetime64 values print
+                            timestamps_to_delete = [str(ts) for ts in grouped.loc[selected_indices, "timestamp"]]
+                            # Remove the selected records from the store
+                            history_store.delete(username, timestamps_to_delete)
+                            get_face_index().remove_timestamps(username, timestamps_to_delete)
+                            st.success("Selected records deleted successfully!")
+                            st.session_state.select_all_state = False
                             st.rerun()
-                        
-                        if st.button("🗑️ Delete", key="delete_button"):
-                            # Get indices of selected rows
-                            selected_indices = edited_df.index[edited_df['Select']].tolist()
-                            if selected_indices:
-                                # Safely get the timestamps to delete
-                                try:
-                                    timestamps_to_delete = grouped.loc[selected_indices, "timestamp"].tolist()
-                                    # Filter out the deleted records
-                                    df = df[~((df["username"] == username) & (df["timestamp"].isin(timestamps_to_delete)))]
-                                    # Save back to CSV
-                                    df.to_csv("history.csv", index=False)
-                                    st.success("Selected records deleted successfully!")
-                                    st.session_state.select_all_state = False
-                                    st.rerun()
-                                except KeyError:
-                                    st.error("Error: Could not find selected records to delete")
-        
-                    # Add spacing between table and chart
-                    st.markdown("<br><br>", unsafe_allow_html=True)
-                    st.markdown("**📊 Emotion Distribution**")
-                    
-                    # Create columns for the selection and chart
-                    col_select, col_chart = st.columns([2, 5])
-                    
-                    with col_select:
-                        # Add record selection for chart
-                        records = grouped["timestamp"].tolist()
-                        records.insert(0, "All")  # Add "All" option
-                        selected_record = st.selectbox("Select record to view:", 
-                                                     ["All"] + [str(ts) for ts in grouped["timestamp"].tolist()], 
-                                                     index=0)
-
-                        # Filter data based on selection
-                        if selected_record == "All":
-                            chart_data = user_df
-                        else:
-                            chart_data = user_df[user_df["timestamp"] == selected_record]
+                        except KeyError:
+                            st.error("Error: Could not find selected records to delete")
+
+            # Add spacing between table and chart
+            st.markdown("<br><br>", unsafe_allow_html=True)
+            st.markdown("**📊 Emotion Distribution**")
+            
+            # Create columns for the selection and chart
+            col_select, col_chart = st.columns([2, 5])
+            
+            with col_select:
+                # Add record selection for chart
+                selected_record = st.selectbox("Select record to view:",
+                                             ["All"] + grouped["timestamp"].tolist(),
+                                             index=0, format_func=str)
 
-                    with col_chart:
-                        # Display chart with simplified title
-                        fig = px.pie(chart_data, names="Emotion")
-                        st.plotly_chart(fig, use_container_width=True)
+                # Totals for "All" come from the store's running counts
+                if selected_record == "All":
+                    counts = history_store.emotion_counts(username)
                 else:
-                    st.info("No history records found for your account.")
-            else:
-                st.info("No history records found.")
+                    row = emotion_counts.loc[selected_record]
+                    counts = row[row > 0].to_dict()
+
+            with col_chart:
+                # Display chart with simplified title
+                fig = px.pie(names=list(counts.keys()), values=list(counts.values()))
+                st.plotly_chart(fig, use_container_width=True)
         else:
-            st.info("No history file found.")
+            st.info("No history records found for your account.")
     except Exception as e:
         st.error(f"Error loading history: {e}")
 
@@ -313,24 +466,48 @@ def main_app():
             uploaded_file = st.file_uploader("Upload an image (JPG/PNG)", type=["jpg", "png"])
             if uploaded_file:
                 try:
-                    image = Image.open(uploaded_file)
-                    img = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                    detections = detector.detect_emotions(img)
-                    detected_img = detector.draw_detections(img, detections)
+                    # One job per uploaded file; reruns just poll it
+                    jobs = st.session_state.setdefault("detection_jobs", {})
+                    file_key = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+                    last_result = st.session_state.get("detection_result")
+                    if last_result is None or last_result[0] != file_key:
+                        if file_key not in jobs:
+                            jobs[file_key] = job_queue.submit(process_upload, uploaded_file.getvalue(), username)
+
+                        status = job_queue.status(jobs[file_key])
+                        if status == "unknown":
+                            del jobs[file_key]
+                            st.rerun()
+                        if status in ("pending", "running"):
+                            st.info("⏳ Analyzing image...")
+                            time.sleep(0.5)
+                            st.rerun()
+
+                        # The session keeps only the latest result; the queue lets go of it once read
+                        last_result = (file_key, job_queue.result(jobs[file_key]))
+                        job_queue.forget(jobs.pop(file_key))
+                        st.session_state["detection_result"] = last_result
+
+                    detections, original_bytes, detected_bytes = last_result[1]
+
+                    # Correct pluralization
+                    face_word = "face" if len(detections) == 1 else "faces"
 
                     col1, col2 = st.columns([1, 2])
                     with col1:
                         st.subheader("🔍 Detection Results")
                         if detections:
                             emotions = [d["emotion"] for d in detections]
-                            confidences = [d["confidence"] for d in detections]
                             
-                            # Correct pluralization
-                            face_word = "face" if len(detections) == 1 else "faces"
                             st.success(f"🎭 {len(detections)} {face_word} detected")
                             
-                            for i, (emo, conf) in enumerate(zip(emotions, confidences)):
-                                st.write(f"- Face {i + 1}: {emo} ({conf}%)")
+                            for i, det in enumerate(detections):
+                                line = f"- Face {i + 1}: {det['emotion']} ({det['confidence']}%)"
+                                seen = det.get("seen_before")
+                                if seen:
+                                    uploads = "upload" if len(seen) == 1 else "uploads"
+                                    line += f" · seen in {len(seen)} earlier {uploads}, last {seen[-1]}"
+                                st.write(line)
                             
                             # Add emotion totals
                             emotion_counts = {}
@@ -340,20 +517,21 @@ def main_app():
                             st.write(total_text)
                             
                             show_detection_guide()
-                            save_history(username, emotions, confidences, "Unknown")
                         else:
                             st.warning("No faces were detected in the uploaded image.")
                     with col2:
                         t1, t2 = st.tabs(["Original Image", "Processed Image"])
                         with t1:
-                            st.image(image, use_container_width=True)
+                            st.image(original_bytes, use_container_width=True)
                         with t2:
-                            st.image(detected_img, channels="BGR", use_container_width=True,
+                            st.image(detected_bytes, use_container_width=True,
                                     caption=f"Detected {len(detections)} {face_word}")
                 except Exception as e:
                     st.error(f"Error while processing the image: {e}")
 
         with tabs[1]:
+            import pandas as pd
+
             st.subheader("🗺️ Random Location Sample (Demo)")
             st.map(pd.DataFrame({
                 'lat': [3.139 + random.uniform(-0.01, 0.01)],
@@ -0,0 +1,197 @@
+"""Latency benchmarks for the detection pipeline and history pages.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py --output bench_results.json
+
+Each stage reports p50/p95/p99 latency (ms), throughput and peak RSS. On
+Linux the kernel's peak-RSS counter is reset before each stage, so the peak
+is the stage's own; elsewhere it is the process peak so far (rss_scope).
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import cv2
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emotion_utils.config import EMOTION_LABELS
+from emotion_utils.detector import EmotionDetector
+from emotion_utils.history import SQLiteHistoryStore
+from emotion_utils.summary import summarize_sessions
+
+def reset_peak_rss():
+    """Reset the peak-RSS counter (VmHWM) via /proc; returns False where unsupported"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak RSS since the last reset_peak_rss(), falling back to the process peak"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Set by timed(): whether the last stage's peak RSS is its own or the process's
+_rss_scope = "process"
+
+def summarize(name, timings, items=None, **extra):
+    timings = np.asarray(timings)
+    total = timings.sum()
+    result = {
+        "stage": name,
+        "runs": len(timings),
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "p99_ms": float(np.percentile(timings, 99) * 1000),
+        "throughput_per_s": float((items or len(timings)) / total) if total > 0 else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_scope": _rss_scope,
+    }
+    result.update(extra)
+    print(f"{name:<40} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+          f"p99 {result['p99_ms']:9.2f} ms  rss {result['peak_rss_mb']:8.1f} MB")
+    return result
+
+def timed(fn, repeat):
+    global _rss_scope
+    _rss_scope = "stage" if reset_peak_rss() else "process"
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def synthetic_image(width, height, faces, seed=0):
+    """BGR image with simple drawn faces laid out on a grid"""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(90, 160, size=(height, width, 3), dtype=np.uint8)
+    cols = max(1, int(np.ceil(np.sqrt(faces))))
+    rows = max(1, int(np.ceil(faces / cols)))
+    cell_w, cell_h = width // cols, height // rows
+    radius = max(8, int(min(cell_w, cell_h) * 0.35))
+    for i in range(faces):
+        cx = (i % cols) * cell_w + cell_w // 2
+        cy = (i // cols) * cell_h + cell_h // 2
+        cv2.ellipse(img, (cx, cy), (int(radius * 0.8), radius), 0, 0, 360, (150, 180, 220), -1)
+        for dx in (-radius // 3, radius // 3):
+            cv2.circle(img, (cx + dx, cy - radius // 4), max(2, radius // 8), (40, 40, 40), -1)
+        cv2.ellipse(img, (cx, cy + radius // 3), (radius // 3, radius // 6), 0, 0, 180, (60, 60, 150), 2)
+    return img
+
+def bench_detection(args, detector):
+    results = []
+    for resolution in args.resolutions:
+        width, height = (int(v) for v in resolution.split("x"))
+        for faces in args.faces:
+            img = synthetic_image(width, height, faces)
+            detections = detector.detect_emotions(img)
+            timings = timed(lambda: detector.detect_emotions(img), args.repeat)
+            results.append(summarize(f"detect_emotions {resolution} {faces}f", timings,
+                                     resolution=resolution, faces=faces, detected=len(detections)))
+            timings = timed(lambda: detector.draw_detections(img, detections), args.repeat)
+            results.append(summarize(f"draw_detections {resolution} {faces}f", timings,
+                                     resolution=resolution, faces=faces))
+
+        images = [synthetic_image(width, height, args.faces[-1], seed=i) for i in range(args.batch_size)]
+        timings = timed(lambda: detector.detect_emotions_batch(images), args.repeat)
+        results.append(summarize(f"detect_emotions_batch {resolution} x{args.batch_size}", timings,
+                                 items=args.batch_size * args.repeat,
+                                 resolution=resolution, batch_size=args.batch_size))
+    return results
+
+def generate_history(store, rows, users, seed=0):
+    """Fill a store with rows spread over users, 1-4 faces per session"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    chunk = []
+    written = 0
+    while written < rows:
+        ts = (start + timedelta(seconds=written)).strftime("%Y-%m-%d %H:%M:%S")
+        user = f"user{rng.randrange(users)}"
+        for _ in range(min(rng.randint(1, 4), rows - written)):
+            chunk.append((user, "Unknown", rng.choice(EMOTION_LABELS), round(rng.uniform(30, 100), 2), ts))
+            written += 1
+        if len(chunk) >= 50000:
+            store.append(chunk)
+            chunk = []
+    if chunk:
+        store.append(chunk)
+
+def bench_history(args, workdir):
+    results = []
+    for rows in args.history_rows:
+        path = os.path.join(workdir, f"history_{rows}.db")
+        store = SQLiteHistoryStore(path)
+        start = time.perf_counter()
+        generate_history(store, rows, args.users)
+        print(f"generated {rows} history rows in {time.perf_counter() - start:.1f}s")
+
+        counter = iter(range(10 ** 9))
+        def save():
+            ts = f"2030-01-01 00:00:{next(counter):09d}"
+            store.append([("user0", "Unknown", "happy", 99.0, ts), ("user0", "Unknown", "sad", 51.0, ts)])
+        results.append(summarize(f"save_history {rows} rows", timed(save, args.repeat), history_rows=rows))
+
+        def show():
+            store.count_sessions("user1")
+            page = store.load_page_frame("user1", 20, 0)
+            if not page.empty:
+                summarize_sessions(page)
+            store.emotion_counts("user1")
+        results.append(summarize(f"show_user_history {rows} rows", timed(show, args.repeat), history_rows=rows))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", nargs="+", default=["640x480", "1920x1080", "4000x3000"])
+    parser.add_argument("--faces", nargs="+", type=int, default=[1, 5, 20])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--history-rows", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--backend", default="opencv")
+    parser.add_argument("--classifier", choices=["deepface", "onnx"], default="deepface")
+    parser.add_argument("--onnx-model", default="models/emotion.int8.onnx")
+    parser.add_argument("--skip-detection", action="store_true")
+    parser.add_argument("--skip-history", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    report = {"started": datetime.now().isoformat(timespec="seconds"), "args": vars(args), "stages": []}
+    if not args.skip_detection:
+        # No near-duplicate reuse: repeated frames must each run the model to be timed.
+        # Embeddings are off too, so stages time detection and classification alone
+        detector = EmotionDetector(backend=args.backend, classifier=args.classifier,
+                                   onnx_model_path=args.onnx_model, dedup_similarity=0, embeddings=False)
+        report["load_times"] = detector.load_times
+        report["stages"] += bench_detection(args, detector)
+    if not args.skip_history:
+        with tempfile.TemporaryDirectory() as workdir:
+            report["stages"] += bench_history(args, workdir)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
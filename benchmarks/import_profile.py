@@ -0,0 +1,97 @@
+"""Import-time profile and cold-start budget check.
+
+Run from the repository root:
+
+    python benchmarks/import_profile.py --budget-ms 1500
+
+"startup" imports everything app.py imports at module level, i.e. what the
+login page waits for after a restart. The other targets show what the first
+detection and the history page add on top. Each target runs in a fresh
+interpreter with -X importtime; the slowest top-level imports are listed.
+Exits non-zero when startup exceeds the budget.
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def startup_imports(app_path=os.path.join(ROOT, "app.py")):
+    """Modules app.py imports at module level"""
+    with open(app_path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return modules
+
+def profile(modules, top):
+    code = "; ".join(f"import {name}" for name in modules)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        return {"modules": modules, "error": proc.stderr.strip().splitlines()[-1]}
+
+    roots = []
+    for line in proc.stderr.splitlines():
+        match = LINE.match(line)
+        # Only top-level entries (one space of indent) so nested imports are not double counted
+        if match and len(match.group(3)) == 1:
+            roots.append((int(match.group(2)) / 1000, match.group(4)))
+    roots.sort(reverse=True)
+    return {
+        "modules": modules,
+        "wall_ms": round(wall_ms, 1),
+        "import_ms": round(sum(ms for ms, _ in roots), 1),
+        "slowest": [{"module": name, "cumulative_ms": round(ms, 1)} for ms, name in roots[:top]],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1500,
+                        help="Maximum import time for the startup target")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    targets = {
+        "startup": startup_imports(),
+        "first_detection": ["emotion_utils.detector", "deepface.DeepFace"],
+        "history_page": ["pandas", "plotly.express", "emotion_utils.summary"],
+    }
+    report = {name: profile(modules, args.top) for name, modules in targets.items()}
+
+    for name, result in report.items():
+        if "error" in result:
+            print(f"{name}: failed ({result['error']})")
+            continue
+        print(f"{name}: {result['import_ms']:.0f} ms imports, {result['wall_ms']:.0f} ms interpreter wall")
+        for entry in result["slowest"]:
+            print(f"    {entry['cumulative_ms']:9.1f} ms  {entry['module']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    startup = report["startup"]
+    if "error" in startup:
+        print("FAIL: startup imports could not be measured")
+        sys.exit(1)
+    if startup["import_ms"] > args.budget_ms:
+        print(f"FAIL: startup imports exceed the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
+    print(f"OK: startup imports within the {args.budget_ms:.0f} ms budget")
+
+if __name__ == "__main__":
+    main()
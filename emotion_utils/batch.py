@@ -0,0 +1,238 @@
+"""Offline emotion detection over a folder or ZIP archive of images.
+
+    python -m emotion_utils.batch photos/ --output results.jsonl
+    python -m emotion_utils.batch archive.zip --output results.parquet --workers 4 --username ops
+
+Re-running the same command resumes from the checkpoint written next to the output.
+
+With --username every image becomes its own history session: its timestamp
+is the run's start time plus one second per image in input order, so a
+resumed run gives an image the same timestamp and replaces its rows.
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+
+import cv2
+import numpy as np
+
+from .config import get_settings
+from .detector import EmotionDetector
+from .history import open_history_store
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def iter_sources(path):
+    """Yield (name, read_bytes) for every image in a directory tree or ZIP file"""
+    if os.path.isfile(path) and zipfile.is_zipfile(path):
+        # Left open on purpose: readers run after this generator is exhausted,
+        # and the archive closes once the last read_bytes is dropped
+        archive = zipfile.ZipFile(path)
+        for name in sorted(archive.namelist()):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield name, functools.partial(archive.read, name)
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                full_path = os.path.join(root, filename)
+                yield os.path.relpath(full_path, path), functools.partial(_read_file, full_path)
+
+def decode(read_bytes):
+    """Decode straight to BGR, or None if the file is not a readable image"""
+    try:
+        data = np.frombuffer(read_bytes(), dtype=np.uint8)
+        return cv2.imdecode(data, cv2.IMREAD_COLOR)
+    except Exception as e:
+        print(f"Decode error: {e}", file=sys.stderr)
+        return None
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+class JsonlWriter:
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, records):
+        for record in records:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """Streams record batches into a Parquet file as row groups (needs pyarrow)"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow")
+        self._pa, self._pq = pa, pq
+        # Parquet files cannot be appended to, so a resumed run writes a new part
+        base, ext = os.path.splitext(path)
+        part = 0
+        while os.path.exists(path):
+            part += 1
+            path = f"{base}.part{part}{ext}"
+        self.path = path
+        self._writer = None
+        detection = pa.struct([("emotion", pa.string()), ("confidence", pa.float32()),
+                               ("x", pa.int32()), ("y", pa.int32()), ("w", pa.int32()), ("h", pa.int32())])
+        self.schema = pa.schema([("source", pa.string()), ("faces", pa.int32()),
+                                 ("detections", pa.list_(detection)), ("error", pa.string())])
+
+    def write(self, records):
+        table = self._pa.Table.from_pylist(records, schema=self.schema)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, self.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+STARTED_PREFIX = "#started "
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def load_checkpoint(path):
+    """Return (run start time, names already processed), recording a start time if there is none"""
+    started, done = None, set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.startswith(STARTED_PREFIX):
+                    started = started or datetime.strptime(line[len(STARTED_PREFIX):], TIMESTAMP_FORMAT)
+                else:
+                    done.add(line)
+    if started is None:
+        started = datetime.now().replace(microsecond=0)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(f"{STARTED_PREFIX}{started:{TIMESTAMP_FORMAT}}\n")
+    return started, done
+
+def run(args):
+    checkpoint_path = f"{args.output}.checkpoint"
+    started, done = load_checkpoint(checkpoint_path)
+    if done:
+        print(f"Resuming: skipping {len(done)} already processed images")
+    # The position in the full input fixes each image's history timestamp across resumes
+    sources = ((name, (position, read)) for position, (name, read) in enumerate(iter_sources(args.input))
+               if name not in done)
+
+    writer = ParquetWriter(args.output) if args.output.endswith(".parquet") else JsonlWriter(args.output)
+    # Same store, backend and legacy CSV migration as the app, so neither can skip the other's data
+    history = None
+    if args.username:
+        history = open_history_store(args.history_path, backend=args.history_backend or get_settings().history_backend)
+
+    # Batch runs keep no face index, so no identity embeddings are computed
+    detector_options = {"backend": args.backend, "max_edge": args.max_edge, "classifier": args.classifier,
+                        "onnx_model_path": args.onnx_model, "embeddings": False}
+    if args.workers > 0:
+        from .workers import InferencePool
+        pool = InferencePool(workers=args.workers, timeout=args.timeout, **detector_options)
+        submit = pool.submit
+        max_in_flight = args.workers * 2
+    else:
+        pool = None
+        detector = EmotionDetector(**detector_options)
+
+        def submit(images):
+            future = Future()
+            future.set_result(detector.detect_emotions_batch(images))
+            return future
+        max_in_flight = 1
+
+    processed = 0
+    in_flight = deque()
+
+    def finish(names, positions, future, failed):
+        nonlocal processed
+        detections = iter(future.result(timeout=args.timeout))
+        records, rows, stamps = [], [], []
+        for name, position in zip(names, positions):
+            if name in failed:
+                records.append({"source": name, "faces": 0, "detections": [], "error": "decode failed"})
+                continue
+            dets = next(detections)
+            records.append({"source": name, "faces": len(dets), "detections": dets, "error": None})
+            stamp = (started + timedelta(seconds=position)).strftime(TIMESTAMP_FORMAT)
+            stamps.append(stamp)
+            rows.extend((args.username, "Batch import", d["emotion"], float(d["confidence"]), stamp) for d in dets)
+        writer.write(records)
+        if history is not None and stamps:
+            # Drop rows a crashed run wrote for these images before the checkpoint caught up
+            history.delete(args.username, stamps)
+            history.append(rows)
+        # Only checkpoint once results are written, so a crash re-processes rather than loses
+        with open(checkpoint_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{name}\n" for name in names)
+        processed += len(names)
+        print(f"{processed} images processed", end="\r", flush=True)
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.decode_threads) as decoder:
+            for chunk in chunked(sources, args.batch_size):
+                names = [name for name, _ in chunk]
+                positions = [position for _, (position, _) in chunk]
+                images = list(decoder.map(decode, [read for _, (_, read) in chunk]))
+                failed = {name for name, img in zip(names, images) if img is None}
+                valid = [img for img in images if img is not None]
+                future = submit(valid) if valid else Future()
+                if not valid:
+                    future.set_result([])
+                in_flight.append((names, positions, future, failed))
+                while len(in_flight) >= max_in_flight:
+                    finish(*in_flight.popleft())
+            while in_flight:
+                finish(*in_flight.popleft())
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown()
+    print(f"\nDone: {processed} images -> {getattr(writer, 'path', args.output)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="Folder or .zip archive of JPG/PNG images")
+    parser.add_argument("--output", default="results.jsonl", help=".jsonl or .parquet")
+    parser.add_argument("--batch-size", type=int, default=get_settings().batch_size)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Detection processes (0 runs in this process)")
+    parser.add_argument("--decode-threads", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--backend", help="Defaults to DETECTOR_BACKEND / opencv")
+    parser.add_argument("--max-edge", type=int)
+    parser.add_argument("--classifier", choices=["deepface", "onnx"])
+    parser.add_argument("--onnx-model")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--username", help="Also record detections in this user's history")
+    parser.add_argument("--history-backend", choices=["sqlite", "parquet"],
+                        help="Defaults to HISTORY_BACKEND / sqlite")
+    parser.add_argument("--history-path", "--history-db",
+                        help="Defaults to the app's history.db or history_parquet/")
+    run(parser.parse_args(argv))
+
+if __name__ == "__main__":
+    main()
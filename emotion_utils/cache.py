@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+class ResultCache:
+    """Detection results keyed by image content, with an LRU and optional disk tier"""
+
+    def __init__(self, max_entries=256, disk_dir=None):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(img, settings):
+        """Hash the pixel buffer together with the detector settings"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr((img.shape, str(img.dtype), settings)).encode())
+        digest.update(memoryview(img) if img.flags.c_contiguous else img.tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_bytes_key(data, settings):
+        """Hash an encoded upload together with the detector settings, without decoding it"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr(("bytes", settings)).encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self._read_disk(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        self._write_disk(key, value)
+
+    def clear(self):
+        """Drop every cached result, in memory and on disk"""
+        with self._lock:
+            self._entries.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.disk_dir, name))
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        try:
+            # Write then rename so readers never see a partial file
+            tmp_path = f"{self._disk_path(key)}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, self._disk_path(key))
+        except OSError as e:
+            print(f"Cache write error: {e}")
@@ -1,18 +1,119 @@
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+
+# Output order of DeepFace's emotion model; everything indexed by emotion uses it
+EMOTION_LABELS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+
+# BGR colours aligned with EMOTION_LABELS
+EMOTION_COLORS = (
+    (0, 165, 255),   # angry: Orange
+    (0, 128, 0),     # disgust: Dark Green
+    (128, 0, 128),   # fear: Purple
+    (0, 255, 0),     # happy: Green
+    (0, 0, 255),     # sad: Red
+    (255, 0, 255),   # surprise: Pink
+    (255, 255, 0),   # neutral: Yellow
+)
+
+DEFAULT_COLOR = (255, 255, 255)
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+def _env_float(name, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    """Detector and app tunables, read once from the environment by get_settings()"""
+
+    detector_backend: str = "opencv"
+    classifier: str = "deepface"
+    # Export writes the int8 model only once it agrees with the float one on the parity fixture
+    onnx_model_path: str = "models/emotion.int8.onnx"
+    max_image_edge: int = 1280
+    display_max_edge: int = 1280
+    batch_size: int = 16
+    cache_size: int = 256
+    cache_dir: str = None
+    inference_workers: int = 0
+    inference_timeout: float = 60.0
+    job_workers: int = 2
+    history_backend: str = "sqlite"
+    # PBKDF2-SHA256 work factor for new hashes (OWASP 2023 guidance)
+    password_iterations: int = 600_000
+    admin_users: frozenset = frozenset()
+    # SFace identity embedding per detected face, used to spot faces seen in earlier uploads
+    face_embeddings: bool = True
+    # Directory holding one face index file per user
+    face_index_path: str = "face_index"
+    # Cosine similarity above which two SFace embeddings count as the same person
+    same_face_similarity: float = 0.6
+    # Crops this similar to an already classified one reuse their scores, e.g. 0.995
+    # for re-uploads and still video; off (0) by default since hits skip the model
+    dedup_similarity: float = 0.0
+    metrics_enabled: bool = False
+    # Prometheus text file refreshed after each upload, for a textfile collector
+    metrics_file: str = None
+    emotion_labels: tuple = EMOTION_LABELS
+    emotion_colors: tuple = EMOTION_COLORS
+    # Emotion name -> position in emotion_labels/emotion_colors, filled in __post_init__
+    # Left out of __eq__/__hash__: it is derived from emotion_labels, and mappingproxy is unhashable
+    label_index: MappingProxyType = field(default=None, init=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "label_index",
+                           MappingProxyType({label: i for i, label in enumerate(self.emotion_labels)}))
+
+    def color_for(self, emotion):
+        index = self.label_index.get(emotion)
+        return DEFAULT_COLOR if index is None else self.emotion_colors[index]
+
+    @classmethod
+    def from_env(cls):
+        # With slots=True the class attributes are slot descriptors, so read defaults off an instance
+        defaults = cls()
+        return cls(
+            detector_backend=os.getenv("DETECTOR_BACKEND", defaults.detector_backend),
+            classifier=os.getenv("EMOTION_CLASSIFIER", defaults.classifier),
+            onnx_model_path=os.getenv("ONNX_MODEL_PATH", defaults.onnx_model_path),
+            max_image_edge=_env_int("MAX_IMAGE_EDGE", defaults.max_image_edge),
+            display_max_edge=_env_int("DISPLAY_MAX_EDGE", defaults.display_max_edge),
+            batch_size=_env_int("BATCH_SIZE", defaults.batch_size),
+            cache_size=_env_int("CACHE_SIZE", defaults.cache_size),
+            cache_dir=os.getenv("DETECTION_CACHE_DIR") or None,
+            inference_workers=_env_int("INFERENCE_WORKERS", defaults.inference_workers),
+            inference_timeout=_env_float("INFERENCE_TIMEOUT", defaults.inference_timeout),
+            job_workers=_env_int("JOB_WORKERS", defaults.job_workers),
+            history_backend=os.getenv("HISTORY_BACKEND", defaults.history_backend),
+            password_iterations=_env_int("PASSWORD_ITERATIONS", defaults.password_iterations),
+            admin_users=frozenset(name.strip() for name in os.getenv("ADMIN_USERS", "").split(",")
+                                  if name.strip()),
+            face_embeddings=os.getenv("FACE_EMBEDDINGS", "1") != "0",
+            face_index_path=os.getenv("FACE_INDEX_PATH", defaults.face_index_path),
+            same_face_similarity=_env_float("SAME_FACE_SIMILARITY", defaults.same_face_similarity),
+            dedup_similarity=_env_float("DEDUP_SIMILARITY", defaults.dedup_similarity),
+            metrics_enabled=os.getenv("ENABLE_METRICS") == "1",
+            metrics_file=os.getenv("METRICS_FILE") or None,
+        )
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """Process-wide settings, built on first call"""
+    return Settings.from_env()
+
+@lru_cache(maxsize=None)
 def get_config():
     return {
         "title": "AI Emotion Detector",
         "language_selector": {
             "label": "🌐 Select Language"
         },
-        "color_map": {
-            "happy": (0, 255, 0),      # Green
-            "neutral": (255, 255, 0),   # Yellow
-            "sad": (0, 0, 255),         # Red
-            "angry": (0, 165, 255),     # Orange
-            "fear": (128, 0, 128),      # Purple
-            "surprise": (255, 0, 255),  # Pink
-            "disgust": (0, 128, 0)      # Dark Green
-        },
+        "color_map": dict(zip(get_settings().emotion_labels, get_settings().emotion_colors)),
         "translations": {
             "English": {
                 "title": "AI Emotion Detector",
@@ -1,64 +1,433 @@
-from deepface import DeepFace
 import cv2
 import numpy as np
+import os
+import time
+from importlib import metadata
+from .config import get_settings
+from .face_index import FaceIndex
+from .metrics import METRICS
+from .preprocess import downscale, encode_image, face_to_input, scale_region
+from .video import FaceTracker
+
+# Face detectors DeepFace can build; "opencv" runs on cv2 alone, without deepface
+DETECTOR_BACKENDS = ["opencv", "ssd", "dlib", "mtcnn", "retinaface", "mediapipe", "yolov8", "yunet"]
+
+# "deepface" runs the Keras model, "onnx" an exported model on ONNX Runtime
+CLASSIFIERS = ["deepface", "onnx"]
+
+# Near-duplicate lookup works on crops shrunk to this size; the index is reset past MAX_RECENT_CROPS
+CROP_KEY_SIZE = 16
+MAX_RECENT_CROPS = 50_000
+
+# The cascade and parameters DeepFace's opencv backend uses
+HAAR_CASCADE = "haarcascade_frontalface_default.xml"
+
+# DeepFace's SFace weights, run through cv2's FaceRecognizerSF as DeepFace does
+SFACE_WEIGHTS = "face_recognition_sface_2021dec.onnx"
+
+def _face_detector_module():
+    # deepface pulls in TensorFlow, so it is only imported once a model is needed
+    from deepface.detectors import FaceDetector
+    return FaceDetector
+
+def _sface_weights_path():
+    home = os.getenv("DEEPFACE_HOME", os.path.expanduser("~"))
+    return os.path.join(home, ".deepface", "weights", SFACE_WEIGHTS)
+
+def _deepface_version():
+    try:
+        return metadata.version("deepface")
+    except metadata.PackageNotFoundError:
+        return ""
 
 class EmotionDetector:
-    def __init__(self):
-        self.color_map = {
-            "happy": (0, 255, 0),      # Green
-            "neutral": (255, 255, 0),  # Yellow
-            "sad": (0, 0, 255),       # Red
-            "angry": (0, 165, 255),   # Orange
-            "fear": (128, 0, 128),    # Purple
-            "surprise": (255, 0, 255),# Pink
-            "disgust": (0, 128, 0)    # Dark Green
-        }
+    def __init__(self, backend=None, cache=None, preload=True, max_edge=None,
+                 classifier=None, onnx_model_path=None, dedup_similarity=None, embeddings=None):
+        """Options left as None come from get_settings()"""
+        self.settings = get_settings()
+        backend = backend or self.settings.detector_backend
+        classifier = classifier or self.settings.classifier
+        if backend not in DETECTOR_BACKENDS:
+            raise ValueError(f"Unknown detector backend '{backend}', expected one of {DETECTOR_BACKENDS}")
+        if classifier not in CLASSIFIERS:
+            raise ValueError(f"Unknown classifier '{classifier}', expected one of {CLASSIFIERS}")
+        self.detector_backend = backend
+        self.max_edge = max_edge if max_edge is not None else self.settings.max_image_edge
+        self.classifier = classifier
+        self.onnx_model_path = onnx_model_path or self.settings.onnx_model_path
+        self.face_detector = None
+        self.emotion_model = None
+        self.embeddings = embeddings if embeddings is not None else self.settings.face_embeddings
+        self.embedding_model = None
+        self.dedup_similarity = dedup_similarity if dedup_similarity is not None else self.settings.dedup_similarity
+        self.recent_crops = FaceIndex(CROP_KEY_SIZE * CROP_KEY_SIZE) if self.dedup_similarity else None
+        self.cache = cache
+        self.load_times = {}
+        self._label_sprites = {}
+        if preload:
+            self.load_models()
+
+    def load_models(self, warmup=True):
+        """Build the face detector and emotion model now instead of on first use
+
+        Returns the seconds spent per step, also kept in self.load_times.
+        """
+        start = time.perf_counter()
+        # Built once here and reused on every call
+        self.face_detector = self._build_face_detector()
+        self.load_times["face_detector"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.emotion_model = self._build_emotion_model()
+        self.load_times["emotion_model"] = time.perf_counter() - start
+
+        if self.embeddings:
+            start = time.perf_counter()
+            self.embedding_model = self._build_embedding_model()
+            self.load_times["embedding_model"] = time.perf_counter() - start
+
+        if warmup:
+            # One throwaway pass so graph tracing happens before the first real request
+            start = time.perf_counter()
+            self._extract_faces(np.zeros((224, 224, 3), dtype=np.uint8))
+            self._classify(np.zeros((1, 48, 48), dtype=np.float32))
+            if self.embeddings:
+                self._embed(np.zeros((224, 224, 3), dtype=np.uint8), [{"x": 0, "y": 0, "w": 224, "h": 224}])
+            self.load_times["warmup"] = time.perf_counter() - start
+        return dict(self.load_times)
+
+    def settings_key(self):
+        """Everything that changes detection output; part of every cache key"""
+        if self.classifier == "onnx":
+            model = ("onnx", os.path.basename(self.onnx_model_path), os.path.getmtime(self.onnx_model_path))
+        else:
+            model = ("Emotion", _deepface_version())
+        if self.embeddings:
+            model += ("SFace",)
+        return (self.detector_backend, self.max_edge) + model
 
     def detect_emotions(self, img):
         """Detect emotions using DeepFace"""
+        return self.detect_emotions_batch([img])[0]
+
+    def detect_emotions_batch(self, images):
+        """Detect emotions in several images, classifying all faces in one pass"""
+        if self.cache is None:
+            return self._detect_batch(images)
+
+        settings = self.settings_key()
+        keys = [self.cache.make_key(img, settings) for img in images]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        METRICS.inc("cache_hits", len(images) - len(missing))
+        METRICS.inc("cache_misses", len(missing))
+        if missing:
+            fresh = self._detect_batch([images[i] for i in missing])
+            for i, detections in zip(missing, fresh):
+                results[i] = detections
+                self.cache.put(keys[i], detections)
+        return [[dict(det) for det in detections] for detections in results]
+
+    def _detect_batch(self, images):
+        results = [[] for _ in images]
+        crops, regions, owners, vectors = [], [], [], []
+        for idx, img in enumerate(images):
+            try:
+                with METRICS.span("face_detection"):
+                    faces = self._extract_faces(img, keep_fallback=False)
+            except Exception as e:
+                METRICS.inc("detection_errors")
+                print(f"Detection error: {e}")
+                continue
+            embedded = [None] * len(faces)
+            if faces and self.embeddings:
+                # Real faces only; the whole-image fallback below gets no embedding
+                try:
+                    with METRICS.span("face_embedding"):
+                        embedded = self._embed(img, [region for _, region in faces])
+                except Exception as e:
+                    print(f"Face embedding error: {e}")
+            if not faces:
+                faces = self._fallback_face(img)
+                embedded = [None]
+            for (crop, region), vector in zip(faces, embedded):
+                crops.append(crop)
+                regions.append(region)
+                owners.append(idx)
+                vectors.append(vector)
+        METRICS.inc("images_processed", len(images))
+
+        if not crops:
+            return results
+
         try:
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            results = DeepFace.analyze(
-                img_path=img_rgb,
-                actions=['emotion'],
-                enforce_detection=False,
-                detector_backend='opencv',
-                silent=True
-            )
-            
-            detections = []
-            for result in results:
-                detections.append({
-                    "emotion": result['dominant_emotion'],
-                    "confidence": round(result['emotion'][result['dominant_emotion']], 2),
-                    "x": result['region']['x'],
-                    "y": result['region']['y'],
-                    "w": result['region']['w'],
-                    "h": result['region']['h']
-                })
-            return detections
+            with METRICS.span("emotion_classification"):
+                scores = self._classify_unique(np.stack(crops))
         except Exception as e:
+            METRICS.inc("detection_errors")
             print(f"Detection error: {e}")
-            return []
+            return [[] for _ in images]
+
+        for owner, region, score, vector in zip(owners, regions, scores, vectors):
+            det = self._to_detection(score, region)
+            if vector is not None:
+                det["embedding"] = vector.tolist()
+            results[owner].append(det)
+        for detections in results:
+            METRICS.observe("faces_per_image", len(detections))
+        return results
+
+    def detect_emotions_stream(self, frames, fps=30.0, sample_every=5, classify_every=3,
+                               max_sample_every=30):
+        """Build a per-track emotion timeline from an iterable of BGR frames
+
+        Faces are detected on sampled frames only and tracked by IoU; the
+        emotion model runs for new tracks and then every classify_every
+        samples. Sampling backs off while no face is visible.
+        Returns {track_id: [{"frame", "time", "emotion", "confidence", "classified", x, y, w, h}]}.
+        """
+        tracker = FaceTracker()
+        timeline = {}
+        stride = sample_every
+        next_frame = 0
+        step = 0
+
+        for index, frame in enumerate(frames):
+            if index < next_frame:
+                continue
+            try:
+                faces = self._extract_faces(frame, keep_fallback=False)
+            except Exception as e:
+                print(f"Detection error: {e}")
+                faces = []
+
+            assignments = tracker.update([region for _, region in faces])
+            due = []
+            for (crop, _), (track_id, is_new) in zip(faces, assignments):
+                last = tracker.tracks[track_id]["classified_at"]
+                if is_new or last is None or step - last >= classify_every:
+                    due.append((track_id, crop))
+
+            if due:
+                try:
+                    scores = self._classify_unique(np.stack([crop for _, crop in due]))
+                    for (track_id, _), score in zip(due, scores):
+                        det = self._to_detection(score, tracker.tracks[track_id]["box"])
+                        tracker.tracks[track_id].update(
+                            emotion=det["emotion"], confidence=det["confidence"], classified_at=step
+                        )
+                except Exception as e:
+                    print(f"Detection error: {e}")
+            classified = {track_id for track_id, _ in due}
 
-    def draw_detections(self, img, detections):
+            for (_, region), (track_id, _) in zip(faces, assignments):
+                track = tracker.tracks[track_id]
+                if track["emotion"] is None:
+                    continue
+                timeline.setdefault(track_id, []).append({
+                    "frame": index,
+                    "time": round(index / fps, 3),
+                    "emotion": track["emotion"],
+                    "confidence": track["confidence"],
+                    "classified": track_id in classified,
+                    "x": int(region['x']),
+                    "y": int(region['y']),
+                    "w": int(region['w']),
+                    "h": int(region['h'])
+                })
+
+            stride = sample_every if faces else min(stride * 2, max_sample_every)
+            next_frame = index + stride
+            step += 1
+        return timeline
+
+    def _extract_faces(self, img, keep_fallback=True):
+        """Find faces in a BGR image and return (48x48 gray crop, region) pairs
+
+        Detection runs on a copy downscaled to max_edge; crops are taken from
+        the full-resolution image and regions are in its coordinates. With
+        keep_fallback=False no whole-image region is returned when no face is found.
+        """
+        if self.face_detector is None:
+            self.face_detector = self._build_face_detector()
+        small, scale = downscale(img, self.max_edge)
+
+        pairs = []
+        for box in self._detect_boxes(small):
+            region = scale_region(box, scale, img.shape)
+            pairs.append((face_to_input(img, region), region))
+
+        if not pairs and keep_fallback:
+            pairs = self._fallback_face(img)
+        return pairs
+
+    @staticmethod
+    def _fallback_face(img):
+        # Mirror DeepFace's enforce_detection=False behaviour: the whole image as one face
+        region = {"x": 0, "y": 0, "w": img.shape[1], "h": img.shape[0]}
+        return [(face_to_input(img, region), region)]
+
+    def _build_face_detector(self):
+        if self.detector_backend == "opencv":
+            # Same cascade file DeepFace loads, so detections match without importing TensorFlow
+            return cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, HAAR_CASCADE))
+        return _face_detector_module().build_model(self.detector_backend)
+
+    def _detect_boxes(self, img):
+        """[x, y, w, h] face boxes in img"""
+        if self.detector_backend == "opencv":
+            try:
+                boxes, _, _ = self.face_detector.detectMultiScale3(img, 1.1, 10, outputRejectLevels=True)
+            except cv2.error:
+                return []
+            return [list(box) for box in boxes]
+        faces = _face_detector_module().detect_faces(self.face_detector, self.detector_backend, img, align=False)
+        return [box for _, box, _ in faces]
+
+    def _build_emotion_model(self):
+        if self.classifier == "onnx":
+            from .onnx_classifier import OnnxEmotionClassifier
+            return OnnxEmotionClassifier(self.onnx_model_path)
+        from deepface import DeepFace
+        return DeepFace.build_model("Emotion")
+
+    def _classify(self, crops):
+        """Run the emotion model once on a (N, 48, 48) batch of gray crops"""
+        if self.emotion_model is None:
+            self.emotion_model = self._build_emotion_model()
+        batch = np.expand_dims(crops, axis=-1)
+        predictions = self.emotion_model.predict(batch, verbose=0)
+        return 100 * predictions / predictions.sum(axis=1, keepdims=True)
+
+    def _classify_unique(self, crops):
+        """Like _classify, but crops nearly identical to one seen before reuse its scores
+
+        Crops are compared as mean-centred 16x16 thumbnails, so only
+        re-uploads and near-static video faces match, not merely the same person.
+        """
+        if self.recent_crops is None:
+            return self._classify(crops)
+        keys = np.stack([cv2.resize(crop, (CROP_KEY_SIZE, CROP_KEY_SIZE), interpolation=cv2.INTER_AREA).ravel()
+                         for crop in crops])
+        keys -= keys.mean(axis=1, keepdims=True)
+
+        scores = np.zeros((len(crops), len(self.settings.emotion_labels)), dtype=np.float32)
+        todo = []
+        for i, key in enumerate(keys):
+            match = self.recent_crops.search(key, k=1, min_similarity=self.dedup_similarity)
+            if match:
+                scores[i] = match[0][2]["scores"]
+            else:
+                todo.append(i)
+        METRICS.inc("dedup_hits", len(crops) - len(todo))
+
+        if todo:
+            fresh = self._classify(crops[todo])
+            scores[todo] = fresh
+            if len(self.recent_crops) >= MAX_RECENT_CROPS:
+                self.recent_crops = FaceIndex(CROP_KEY_SIZE * CROP_KEY_SIZE)
+            self.recent_crops.add(keys[todo], [{"scores": row.tolist()} for row in fresh])
+        return scores
+
+    def _build_embedding_model(self):
+        path = _sface_weights_path()
+        if not os.path.isfile(path):
+            # Only to download the weights; inference below runs on cv2 alone
+            from deepface import DeepFace
+            DeepFace.build_model("SFace")
+        return cv2.FaceRecognizerSF.create(path, "")
+
+    def _embed(self, img, regions):
+        """SFace identity embeddings for face regions of a BGR image, as unit-length rows
+
+        Unlike the emotion scores these stay close for the same person across expressions.
+        """
+        if self.embedding_model is None:
+            self.embedding_model = self._build_embedding_model()
+        vectors = []
+        for region in regions:
+            crop = img[region["y"]:region["y"] + region["h"], region["x"]:region["x"] + region["w"]]
+            face = cv2.resize(crop, (112, 112), interpolation=cv2.INTER_AREA)
+            vectors.append(np.ravel(self.embedding_model.feature(face)))
+        return FaceIndex.normalize(vectors)
+
+    def _to_detection(self, scores, region):
+        """Build the detection dict used throughout the app"""
+        best = int(np.argmax(scores))
+        return {
+            "emotion": self.settings.emotion_labels[best],
+            "confidence": round(float(scores[best]), 2),
+            "x": int(region['x']),
+            "y": int(region['y']),
+            "w": int(region['w']),
+            "h": int(region['h'])
+        }
+
+    def draw_detections(self, img, detections, in_place=False):
         """Draw detection boxes with labels"""
-        output_img = img.copy()
-        for det in detections:
-            x, y, w, h = det["x"], det["y"], det["w"], det["h"]
-            emotion = det["emotion"]
-            confidence = det["confidence"]
-            color = self.color_map.get(emotion.lower(), (255, 255, 255))
-            
-            # Draw rectangle
-            cv2.rectangle(output_img, (x, y), (x+w, y+h), color, 3)
-            
-            # Draw label
-            label = f"{emotion} {confidence}%"
-            cv2.putText(
-                output_img, label,
-                (x+5, y-10),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.8, color, 2
-            )
-        return output_img
+        with METRICS.span("draw"):
+            output_img = img if in_place else img.copy()
+            for det in detections:
+                x, y, w, h = det["x"], det["y"], det["w"], det["h"]
+                emotion = det["emotion"]
+                confidence = det["confidence"]
+                color = self.settings.color_for(emotion)
+
+                # Draw rectangle
+                cv2.rectangle(output_img, (x, y), (x+w, y+h), color, 3)
+
+                # Draw label
+                label = f"{emotion} {confidence}%"
+                cv2.putText(
+                    output_img, label,
+                    (x+5, y-10),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, color, 2
+                )
+            return output_img
+
+    def render_detections(self, img, detections, max_edge=None, in_place=False, fmt=".jpg", quality=85):
+        """Draw detections on a display-sized copy and return it encoded (JPEG/WebP bytes)
+
+        Labels show confidence rounded to a whole percent and are blitted from
+        cached pre-rendered sprites instead of calling putText per face.
+        """
+        with METRICS.span("render"):
+            display, scale = downscale(img, max_edge or self.settings.display_max_edge)
+            if display is img and not in_place:
+                display = img.copy()
+            for det in detections:
+                x, y = int(det["x"] / scale), int(det["y"] / scale)
+                w, h = int(det["w"] / scale), int(det["h"] / scale)
+                color = self.settings.color_for(det["emotion"])
+                cv2.rectangle(display, (x, y), (x+w, y+h), color, 3)
+                alpha, ascent = self._label_sprite(det["emotion"], int(round(det["confidence"])))
+                self._blit(display, alpha, x + 5, y - 10 - ascent, color)
+            return encode_image(display, fmt, quality)
+
+    def _label_sprite(self, emotion, percent, font_scale=0.8, thickness=2):
+        """Alpha mask of a rendered label, cached per (emotion, percent)"""
+        key = (emotion, percent)
+        sprite = self._label_sprites.get(key)
+        if sprite is None:
+            label = f"{emotion} {percent}%"
+            (width, height), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+            ascent = height + thickness
+            canvas = np.zeros((ascent + baseline + thickness, width + 2 * thickness), dtype=np.uint8)
+            cv2.putText(canvas, label, (thickness, ascent), cv2.FONT_HERSHEY_SIMPLEX,
+                        font_scale, 255, thickness, cv2.LINE_AA)
+            sprite = ((canvas.astype(np.float32) / 255.0)[..., None], ascent)
+            self._label_sprites[key] = sprite
+        return sprite
+
+    @staticmethod
+    def _blit(img, alpha, left, top, color):
+        """Blend a colour through an alpha mask onto img, clipped to its bounds"""
+        height, width = img.shape[:2]
+        x1, y1 = max(left, 0), max(top, 0)
+        x2, y2 = min(left + alpha.shape[1], width), min(top + alpha.shape[0], height)
+        if x1 >= x2 or y1 >= y2:
+            return
+        a = alpha[y1 - top:y2 - top, x1 - left:x2 - left]
+        roi = img[y1:y2, x1:x2]
+        roi[:] = (roi * (1.0 - a) + np.asarray(color, dtype=np.float32) * a).astype(np.uint8)
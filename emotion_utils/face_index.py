@@ -0,0 +1,189 @@
+import base64
+import json
+import os
+import threading
+from urllib.parse import quote
+
+import numpy as np
+
+class FaceIndex:
+    """Cosine-similarity index over face vectors, optionally persisted to disk
+
+    Small indexes are searched exhaustively. Once an index holds
+    ivf_threshold vectors it is partitioned with k-means into ~sqrt(n) lists
+    and a query only scans the nprobe lists closest to it, so search cost
+    grows sub-linearly. With a path, each vector is appended to that JSONL
+    file on one line together with its metadata, so the two cannot drift apart.
+    """
+
+    def __init__(self, dim, path=None, ivf_threshold=4096, nprobe=8):
+        self.dim = dim
+        self.path = path
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._reset()
+        if path:
+            self._load()
+
+    def _reset(self):
+        self.metadata = []
+        self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self._size = 0
+        self._centroids = None
+        self._lists = []
+        self._trained_size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def normalize(vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def add(self, vectors, metadata):
+        """Add vectors with one metadata dict each, returns their ids"""
+        vectors = self.normalize(vectors)
+        with self._lock:
+            start = self._size
+            self._append(vectors, metadata)
+            if self.path:
+                # One write per call, so a crash can only tear the last line
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(self._encode(vectors, metadata))
+            return list(range(start, self._size))
+
+    def remove(self, predicate):
+        """Drop every entry whose metadata matches predicate, returns how many were removed"""
+        with self._lock:
+            keep = [i for i, meta in enumerate(self.metadata) if not predicate(meta)]
+            removed = self._size - len(keep)
+            if removed:
+                vectors, metadata = self._vectors[keep], [self.metadata[i] for i in keep]
+                self._reset()
+                self._append(vectors, metadata)
+                if self.path:
+                    self._rewrite(vectors, metadata)
+            return removed
+
+    def search(self, vector, k=5, min_similarity=None):
+        """Return up to k (similarity, id, metadata) for the nearest stored vectors; k=None for all"""
+        query = self.normalize(vector)[0]
+        with self._lock:
+            if self._size == 0:
+                return []
+            candidates = self._candidates(query)
+            sims = self._vectors[candidates] @ query
+        top = np.argsort(-sims)[:k]
+        results = []
+        for i in top:
+            if min_similarity is not None and sims[i] < min_similarity:
+                break
+            idx = int(candidates[i])
+            results.append((float(sims[i]), idx, self.metadata[idx]))
+        return results
+
+    def _candidates(self, query):
+        if self._centroids is None:
+            return np.arange(self._size)
+        nearest = np.argsort(-(self._centroids @ query))[:self.nprobe]
+        return np.concatenate([self._lists[c] for c in nearest])
+
+    def _append(self, vectors, metadata):
+        needed = self._size + len(vectors)
+        if needed > len(self._vectors):
+            grown = np.zeros((max(needed, 2 * len(self._vectors), 64), self.dim), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size:needed] = vectors
+        ids = np.arange(self._size, needed)
+        self._size = needed
+        self.metadata.extend(metadata)
+
+        if self._size >= self.ivf_threshold and self._size >= 2 * self._trained_size:
+            self._train()
+        elif self._centroids is not None:
+            assignment = np.argmax(vectors @ self._centroids.T, axis=1)
+            for c in np.unique(assignment):
+                self._lists[c] = np.concatenate([self._lists[c], ids[assignment == c]])
+
+    def _train(self, iterations=10, sample_size=50_000, seed=0):
+        """Spherical k-means over a sample, then assign every vector to a list"""
+        data = self._vectors[:self._size]
+        rng = np.random.default_rng(seed)
+        sample = data[rng.choice(self._size, min(sample_size, self._size), replace=False)]
+        nlist = max(1, int(np.sqrt(self._size)))
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            centroids = self.normalize(centroids)
+
+        assignment = np.argmax(data @ centroids.T, axis=1)
+        self._centroids = centroids
+        self._lists = [np.flatnonzero(assignment == c) for c in range(nlist)]
+        self._trained_size = self._size
+
+    @staticmethod
+    def _encode(vectors, metadata):
+        return "".join(
+            json.dumps({"vector": base64.b64encode(vector.tobytes()).decode("ascii"), "meta": meta}) + "\n"
+            for vector, meta in zip(vectors, metadata)
+        )
+
+    def _rewrite(self, vectors, metadata):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self._encode(vectors, metadata))
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        vectors, metadata, damaged = [], [], False
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    vector = np.frombuffer(base64.b64decode(record["vector"]), dtype=np.float32)
+                    if len(vector) != self.dim or not line.endswith("\n"):
+                        raise ValueError("bad vector")
+                except (ValueError, KeyError, TypeError):
+                    damaged = True
+                    continue
+                vectors.append(vector)
+                metadata.append(record["meta"])
+        vectors = np.array(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if damaged:
+            # Rewrite without the torn or corrupt lines so later appends start clean
+            self._rewrite(vectors, metadata)
+        self._append(vectors, metadata)
+
+class UserFaceIndexes:
+    """One FaceIndex per user under root, so searches never see other users' faces"""
+
+    def __init__(self, root, dim, **index_options):
+        self.root = root
+        self.dim = dim
+        self.index_options = index_options
+        self._indexes = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def for_user(self, username):
+        with self._lock:
+            index = self._indexes.get(username)
+            if index is None:
+                path = os.path.join(self.root, f"{quote(username, safe='')}.jsonl")
+                index = self._indexes[username] = FaceIndex(self.dim, path=path, **self.index_options)
+            return index
+
+    def remove_timestamps(self, username, timestamps):
+        """Drop a user's faces saved at the given history timestamps"""
+        timestamps = set(timestamps)
+        return self.for_user(username).remove(lambda meta: meta.get("timestamp") in timestamps)
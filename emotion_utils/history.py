@@ -0,0 +1,259 @@
+import csv
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+HISTORY_COLUMNS = ["username", "Location", "Emotion", "Confidence", "timestamp"]
+
+def read_csv_batches(path, batch_size=10000):
+    """Yield the rows of a history CSV file as lists of tuples in HISTORY_COLUMNS order"""
+    batch = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            batch.append(tuple(record.get(col, "") for col in HISTORY_COLUMNS))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+class HistoryStore:
+    """Interface for detection history backends"""
+
+    def append(self, rows):
+        """Append (username, location, emotion, confidence, timestamp) rows"""
+        raise NotImplementedError
+
+    def load_user(self, username):
+        """Return all rows for one user, oldest first"""
+        raise NotImplementedError
+
+    def delete(self, username, timestamps):
+        """Delete one user's records at the given timestamps"""
+        raise NotImplementedError
+
+    def count_sessions(self, username):
+        """Number of distinct detection timestamps for one user"""
+        raise NotImplementedError
+
+    def load_page(self, username, limit, offset=0):
+        """Return the rows of one page of a user's sessions, newest session first"""
+        raise NotImplementedError
+
+    def load_page_frame(self, username, limit, offset=0):
+        """load_page as a DataFrame with HISTORY_COLUMNS, categorical Emotion and float32 Confidence"""
+        import pandas as pd
+
+        frame = pd.DataFrame(self.load_page(username, limit, offset), columns=HISTORY_COLUMNS)
+        # Timestamps stay the stored strings, which delete() matches exactly
+        return frame.astype({"Location": "category", "Emotion": "category", "Confidence": "float32"})
+
+    def emotion_counts(self, username):
+        """Return {emotion: count} over all of a user's records"""
+        raise NotImplementedError
+
+    def is_migrated(self):
+        """True once the legacy CSV has been imported, or there was none to import"""
+        raise NotImplementedError
+
+    def migrate_csv(self, path):
+        """Import the legacy CSV and mark the store migrated; an interrupted run can simply be retried"""
+        raise NotImplementedError
+
+    def mark_migrated(self):
+        """Record that no legacy CSV import is pending"""
+        raise NotImplementedError
+
+    def export_csv(self, path):
+        """Write the whole history to a CSV file with the legacy columns"""
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(HISTORY_COLUMNS)
+            writer.writerows(self.iter_all())
+
+    def iter_all(self):
+        """Yield every stored row"""
+        raise NotImplementedError
+
+class SQLiteHistoryStore(HistoryStore):
+    """Append-only history in a SQLite file using WAL journaling"""
+
+    def __init__(self, path="history.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    location TEXT,
+                    emotion TEXT,
+                    confidence REAL,
+                    timestamp TEXT NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_history_user_time "
+                "ON history (username, timestamp)"
+            )
+            # Per-user totals kept up to date on every append/delete
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS emotion_counts (
+                    username TEXT NOT NULL,
+                    emotion TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (username, emotion)
+                )
+            """)
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if conn.execute("SELECT 1 FROM emotion_counts LIMIT 1").fetchone() is None:
+                conn.execute(
+                    "INSERT INTO emotion_counts (username, emotion, count) "
+                    "SELECT username, emotion, COUNT(*) FROM history GROUP BY username, emotion"
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def is_empty(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM history LIMIT 1").fetchone() is None
+
+    def append(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        # One transaction per call, so a detection's faces land together
+        with self._lock, self._connect() as conn:
+            self._insert(conn, rows)
+
+    def _insert(self, conn, rows):
+        conn.executemany(
+            "INSERT INTO history (username, location, emotion, confidence, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        self._bump_counts(conn, [(row[0], row[2]) for row in rows], 1)
+
+    def is_migrated(self):
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone():
+                return True
+            # Stores written before the marker existed were migrated on first use
+            return conn.execute("SELECT 1 FROM history LIMIT 1").fetchone() is not None
+
+    def migrate_csv(self, path):
+        # A single transaction, so a crash mid-import leaves the store empty and unmarked
+        count = 0
+        with self._lock, self._connect() as conn:
+            for batch in read_csv_batches(path):
+                self._insert(conn, batch)
+                count += len(batch)
+            self._set_migrated(conn)
+        return count
+
+    def mark_migrated(self):
+        with self._lock, self._connect() as conn:
+            self._set_migrated(conn)
+
+    def _set_migrated(self, conn):
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('csv_migrated', '1')")
+
+    def _bump_counts(self, conn, pairs, sign):
+        """Add sign * occurrences of each (username, emotion) pair to the totals"""
+        totals = {}
+        for pair in pairs:
+            totals[pair] = totals.get(pair, 0) + 1
+        conn.executemany(
+            "INSERT INTO emotion_counts (username, emotion, count) VALUES (?, ?, ?) "
+            "ON CONFLICT (username, emotion) DO UPDATE SET count = count + excluded.count",
+            [(user, emo, sign * n) for (user, emo), n in totals.items()]
+        )
+
+    def load_user(self, username):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT username, location, emotion, confidence, timestamp FROM history "
+                "WHERE username = ? ORDER BY timestamp, id",
+                (username,)
+            ).fetchall()
+
+    def delete(self, username, timestamps):
+        timestamps = list(timestamps)
+        if not timestamps:
+            return
+        params = [(username, ts) for ts in timestamps]
+        with self._lock, self._connect() as conn:
+            removed = []
+            for param in params:
+                removed.extend(conn.execute(
+                    "SELECT username, emotion FROM history WHERE username = ? AND timestamp = ?",
+                    param
+                ).fetchall())
+            conn.executemany(
+                "DELETE FROM history WHERE username = ? AND timestamp = ?",
+                params
+            )
+            self._bump_counts(conn, removed, -1)
+
+    def count_sessions(self, username):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(DISTINCT timestamp) FROM history WHERE username = ?",
+                (username,)
+            ).fetchone()[0]
+
+    def load_page(self, username, limit, offset=0):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT h.username, h.location, h.emotion, h.confidence, h.timestamp "
+                "FROM history h JOIN ("
+                "    SELECT DISTINCT timestamp FROM history WHERE username = ? "
+                "    ORDER BY timestamp DESC LIMIT ? OFFSET ?"
+                ") page ON h.timestamp = page.timestamp "
+                "WHERE h.username = ? ORDER BY h.timestamp DESC, h.id",
+                (username, limit, offset, username)
+            ).fetchall()
+
+    def emotion_counts(self, username):
+        with self._connect() as conn:
+            return dict(conn.execute(
+                "SELECT emotion, count FROM emotion_counts WHERE username = ? AND count > 0",
+                (username,)
+            ).fetchall())
+
+    def iter_all(self):
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "SELECT username, location, emotion, confidence, timestamp FROM history ORDER BY id"
+            )
+            for row in cursor:
+                yield row
+
+# Where each backend keeps its data when no path is given
+DEFAULT_PATHS = {"sqlite": "history.db", "parquet": "history_parquet"}
+
+def open_history_store(path=None, legacy_csv="history.csv", backend="sqlite"):
+    """Open a history store ("sqlite" or "parquet"), migrating a legacy CSV on first use"""
+    path = path or DEFAULT_PATHS.get(backend)
+    if backend == "parquet":
+        # Imported here so the SQLite backend works without pyarrow installed
+        from .parquet_history import ParquetHistoryStore
+        store = ParquetHistoryStore(path)
+    elif backend == "sqlite":
+        store = SQLiteHistoryStore(path)
+    else:
+        raise ValueError(f"Unknown history backend '{backend}'")
+    if legacy_csv and not store.is_migrated():
+        try:
+            store.migrate_csv(legacy_csv)
+        except FileNotFoundError:
+            store.mark_migrated()
+    return store
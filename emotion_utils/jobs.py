@@ -0,0 +1,76 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class JobQueue:
+    """Runs work on background threads and hands out job IDs to poll"""
+
+    def __init__(self, workers=2, abandon_after=600):
+        """Finished jobs nobody has collected with forget() are dropped after abandon_after seconds"""
+        self.abandon_after = abandon_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._finished_at = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """Start fn in the background and return its job ID"""
+        job_id = uuid.uuid4().hex
+        future = self._executor.submit(fn, *args, **kwargs)
+        with self._lock:
+            self._trim()
+            self._jobs[job_id] = future
+        future.add_done_callback(lambda _: self._mark_finished(job_id))
+        return job_id
+
+    def _mark_finished(self, job_id):
+        with self._lock:
+            if job_id in self._jobs:
+                self._finished_at[job_id] = time.monotonic()
+
+    def run_in_background(self, fn, *args, **kwargs):
+        """Fire-and-forget work whose result nobody polls"""
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    def status(self, job_id):
+        """One of 'pending', 'running', 'done', 'failed' or 'unknown'"""
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None:
+            return "unknown"
+        if future.running():
+            return "running"
+        if not future.done():
+            return "pending"
+        return "failed" if future.exception() is not None else "done"
+
+    def result(self, job_id, timeout=None):
+        """Return the job's result, re-raising its exception if it failed"""
+        with self._lock:
+            future = self._jobs.get(job_id)
+        if future is None:
+            raise KeyError(f"Unknown job {job_id}")
+        return future.result(timeout=timeout)
+
+    def forget(self, job_id):
+        """Release a job once its result has been collected"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._finished_at.pop(job_id, None)
+
+    def _trim(self):
+        # Only results left unread for abandon_after seconds go; a poller never sees "unknown"
+        cutoff = time.monotonic() - self.abandon_after
+        for job_id, finished in list(self._finished_at.items()):
+            if finished < cutoff:
+                del self._jobs[job_id]
+                del self._finished_at[job_id]
+
+    @staticmethod
+    def _log_failure(future):
+        if future.exception() is not None:
+            print(f"Background job error: {future.exception()}")
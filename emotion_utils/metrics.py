@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .config import get_settings
+
+class Metrics:
+    """Opt-in stage timings and counters with a Prometheus text export"""
+
+    def __init__(self, enabled=False, window=1000):
+        self.enabled = enabled
+        self.window = window
+        self._counters = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """Time the block and record it under name (seconds)"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start)
+
+    def inc(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = self._summaries[name] = {"count": 0, "sum": 0.0, "max": 0.0,
+                                                   "recent": deque(maxlen=self.window)}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["recent"].append(value)
+
+    def snapshot(self):
+        """Counters plus count/mean/p50/p95/max per observed value"""
+        with self._lock:
+            counters = dict(self._counters)
+            summaries = {name: dict(s, recent=sorted(s["recent"])) for name, s in self._summaries.items()}
+
+        stats = {}
+        for name, s in summaries.items():
+            recent = s["recent"]
+            stats[name] = {
+                "count": s["count"],
+                "mean": s["sum"] / s["count"],
+                "p50": recent[int(0.50 * (len(recent) - 1))],
+                "p95": recent[int(0.95 * (len(recent) - 1))],
+                "max": s["max"],
+            }
+        return {"counters": counters, "summaries": stats}
+
+    def to_prometheus(self, prefix="perspect"):
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.append(f"{prefix}_{name} {value}")
+        for name, s in sorted(snap["summaries"].items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            lines.append(f'{metric}{{quantile="0.5"}} {s["p50"]}')
+            lines.append(f'{metric}{{quantile="0.95"}} {s["p95"]}')
+            lines.append(f"{metric}_sum {s['mean'] * s['count']}")
+            lines.append(f"{metric}_count {s['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the Prometheus text to path atomically (for a node_exporter textfile collector)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+# Shared instance; set ENABLE_METRICS=1 to record
+METRICS = Metrics(enabled=get_settings().metrics_enabled)
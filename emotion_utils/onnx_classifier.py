@@ -0,0 +1,211 @@
+"""ONNX Runtime backend for the emotion classifier.
+
+Export DeepFace's Keras emotion model once (needs tensorflow and tf2onnx):
+
+    python -m emotion_utils.onnx_classifier export --output models/emotion.onnx
+
+This writes models/emotion.onnx and models/emotion.int8.onnx, whose dense
+layers are int8. The int8 copy is kept only if it agrees with the float
+export on the committed parity fixture, 90 face crops cut by the cv2
+cascade from scikit-image's public-domain NASA astronaut photo. Re-run the
+check with only onnxruntime installed:
+
+    python -m emotion_utils.onnx_classifier parity models/emotion.int8.onnx --reference models/emotion.onnx
+
+or against DeepFace's Keras model itself with --reference deepface. The
+fixture is rebuilt from a folder of face images; --scores also stores
+DeepFace's scores, which then become the default reference:
+
+    python -m emotion_utils.onnx_classifier fixture faces/ --augment
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+# Gray 48x48 uint8 face crops, optionally with DeepFace's scores for them
+PARITY_FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "benchmarks", "parity_faces.npz")
+
+class OnnxEmotionClassifier:
+    """Drop-in for the Keras model's predict() on (N, 48, 48, 1) float32 batches"""
+
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch, verbose=0):
+        return self.session.run(None, {self.input_name: batch.astype(np.float32, copy=False)})[0]
+
+def export_emotion_model(output, quantize=True, fixture=PARITY_FIXTURE, min_agreement=0.95):
+    """Convert DeepFace's emotion model to ONNX, plus a parity-checked int8 copy; returns the paths"""
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    model = DeepFace.build_model("Emotion")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    signature = [tf.TensorSpec((None, 48, 48, 1), tf.float32, name="face")]
+    tf2onnx.convert.from_keras(model, input_signature=signature, output_path=output)
+    paths = [output]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        base, ext = os.path.splitext(output)
+        int8_path = f"{base}.int8{ext}"
+        # Only the dense layers: dynamic int8 Conv becomes ConvInteger, which
+        # older ONNX Runtime CPU builds cannot run with int8 weights
+        quantize_dynamic(output, int8_path, weight_type=QuantType.QInt8,
+                         op_types_to_quantize=["MatMul", "Gemm"])
+        result = check_parity(int8_path, fixture, reference=output)
+        if result["top1_agreement"] < min_agreement:
+            os.remove(int8_path)
+            raise ValueError(f"int8 model disagrees with {output} on "
+                             f"{1 - result['top1_agreement']:.1%} of the fixture faces")
+        paths.append(int8_path)
+    return paths
+
+def _augmented_regions(img, region):
+    """Mirrored, rotated, re-lit, shifted and rescaled copies of one face: (image, region) pairs"""
+    import cv2
+
+    height, width = img.shape[:2]
+    x, y, w, h = region["x"], region["y"], region["w"], region["h"]
+    variants = []
+    for mirrored in (False, True):
+        base = np.ascontiguousarray(img[:, ::-1]) if mirrored else img
+        bx = width - x - w if mirrored else x
+        for angle in (-8, 0, 8):
+            rotation = cv2.getRotationMatrix2D((bx + w / 2, y + h / 2), angle, 1.0)
+            turned = cv2.warpAffine(base, rotation, (width, height), borderMode=cv2.BORDER_REFLECT)
+            for gain in (0.7, 1.0, 1.3):
+                lit = np.clip(turned.astype(np.float32) * gain, 0, 255).astype(np.uint8)
+                for dx, dy, grow in ((0, 0, 0), (-0.08, 0, 0), (0.08, 0.05, 0), (0, -0.05, 0.15), (0, 0, -0.1)):
+                    nw, nh = int(w * (1 + grow)), int(h * (1 + grow))
+                    nx = min(max(int(bx + dx * w - (nw - w) / 2), 0), width - nw)
+                    ny = min(max(int(y + dy * h - (nh - h) / 2), 0), height - nh)
+                    variants.append((lit, {"x": nx, "y": ny, "w": nw, "h": nh}))
+    return variants
+
+def build_parity_fixture(image_dir, output=PARITY_FIXTURE, max_edge=1280, augment=False, scores=False):
+    """Save the face crops found in image_dir for the parity check; returns the face count
+
+    augment adds mirrored, rotated, re-lit, shifted and rescaled copies of every face.
+    scores stores DeepFace's scores for the crops, which then become the
+    check's default reference; this needs DeepFace and its emotion weights.
+    """
+    import cv2
+    from .detector import EmotionDetector, _deepface_version
+    from .preprocess import face_to_input
+
+    # The cv2 cascade, so building crops needs neither DeepFace nor TensorFlow
+    detector = EmotionDetector(backend="opencv", classifier="onnx", max_edge=max_edge, preload=False)
+    crops = []
+    for name in sorted(os.listdir(image_dir)):
+        img = cv2.imread(os.path.join(image_dir, name))
+        if img is None:
+            continue
+        for _, region in detector._extract_faces(img, keep_fallback=False):
+            pairs = _augmented_regions(img, region) if augment else [(img, region)]
+            crops.extend(face_to_input(source, box) for source, box in pairs)
+    if not crops:
+        raise ValueError(f"No faces found in {image_dir}")
+
+    # Crops are uint8 pixels / 255, so storing them as uint8 is lossless
+    batch = np.round(np.stack(crops) * 255).astype(np.uint8)
+    arrays = {"crops": batch, "labels": np.array(detector.settings.emotion_labels)}
+    if scores:
+        reference = EmotionDetector(backend="opencv", max_edge=max_edge, preload=False)
+        arrays["scores"] = reference._classify(batch.astype(np.float32) / 255.0).astype(np.float32)
+        arrays["deepface_version"] = np.array(_deepface_version())
+    np.savez_compressed(output, **arrays)
+    return len(batch)
+
+def _reference_scores(crops, reference):
+    """Scores for crops from reference: an ONNX file, or "deepface" for the Keras model"""
+    from .detector import EmotionDetector
+
+    if reference == "deepface":
+        model = EmotionDetector(preload=False)
+    else:
+        model = EmotionDetector(preload=False, classifier="onnx", onnx_model_path=reference)
+    return model._classify(crops)
+
+def check_parity(onnx_path, fixture=PARITY_FIXTURE, reference=None):
+    """Compare an ONNX model's emotion scores with a reference on the fixture's faces
+
+    reference is an ONNX file (the float export, when checking int8) or
+    "deepface"; without one the fixture's stored DeepFace scores are used.
+    Returns a dict with the face count, top-1 agreement and the mean/max
+    absolute difference in percentage scores.
+    """
+    from .detector import EmotionDetector
+
+    with np.load(fixture) as data:
+        crops = data["crops"].astype(np.float32) / 255.0
+        stored = data["scores"] if "scores" in data.files else None
+    if reference is not None:
+        expected = _reference_scores(crops, reference)
+    elif stored is not None:
+        expected = stored
+    else:
+        raise ValueError(f"{fixture} has no stored scores; pass a reference model")
+    candidate = EmotionDetector(preload=False, classifier="onnx", onnx_model_path=onnx_path)
+    actual = candidate._classify(crops)
+    diff = np.abs(expected - actual)
+    return {
+        "faces": len(crops),
+        "top1_agreement": float(np.mean(expected.argmax(axis=1) == actual.argmax(axis=1))),
+        "mean_abs_diff": float(diff.mean()),
+        "max_abs_diff": float(diff.max()),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Export the emotion model to ONNX")
+    export.add_argument("--output", default="models/emotion.onnx")
+    export.add_argument("--no-quantize", action="store_true")
+    export.add_argument("--fixture", default=PARITY_FIXTURE)
+
+    parity = commands.add_parser("parity", help="Compare an ONNX model with a reference on the fixture's faces")
+    parity.add_argument("model")
+    parity.add_argument("--reference", help='ONNX model or "deepface" (default: the fixture\'s stored scores)')
+    parity.add_argument("--fixture", default=PARITY_FIXTURE)
+    parity.add_argument("--min-agreement", type=float, default=0.95)
+
+    fixture = commands.add_parser("fixture", help="Rebuild the parity fixture from face images")
+    fixture.add_argument("images", help="Folder of images containing faces")
+    fixture.add_argument("--output", default=PARITY_FIXTURE)
+    fixture.add_argument("--augment", action="store_true", help="Add shifted, mirrored and re-lit copies")
+    fixture.add_argument("--scores", action="store_true", help="Store DeepFace's scores (needs DeepFace)")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        paths = export_emotion_model(args.output, quantize=not args.no_quantize, fixture=args.fixture)
+        for path in paths:
+            print(f"Wrote {path}")
+        return
+    if args.command == "fixture":
+        count = build_parity_fixture(args.images, args.output, augment=args.augment, scores=args.scores)
+        print(f"Wrote {count} faces to {args.output}")
+        return
+
+    result = check_parity(args.model, args.fixture, reference=args.reference)
+    print(", ".join(f"{k}: {v:.4f}" if isinstance(v, float) else f"{k}: {v}" for k, v in result.items()))
+    if result["top1_agreement"] < args.min_agreement:
+        print(f"FAIL: top-1 agreement below {args.min_agreement}")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import threading
+import uuid
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .history import HISTORY_COLUMNS, HistoryStore, read_csv_batches
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Written to the root once the legacy CSV import has finished
+MIGRATED_MARKER = ".csv_migrated"
+
+# Username is not stored in the files; it is the partition directory
+SCHEMA = pa.schema([
+    ("location", pa.dictionary(pa.int32(), pa.string())),
+    ("emotion", pa.dictionary(pa.int32(), pa.string())),
+    ("confidence", pa.float32()),
+    ("timestamp", pa.timestamp("s")),
+])
+
+class ParquetHistoryStore(HistoryStore):
+    """History as typed Parquet files partitioned by user
+
+    Every append writes one small file into the user's directory; compact()
+    merges them. Reads memory-map only the user's partition and only the
+    columns a query needs.
+    """
+
+    def __init__(self, root="history_parquet", compact_after=64):
+        self.root = root
+        self.compact_after = compact_after
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _partition(self, username):
+        return os.path.join(self.root, f"user={quote(username, safe='')}")
+
+    def _files(self, username):
+        path = self._partition(username)
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.path.join(path, name) for name in os.listdir(path)
+                      if name.endswith(".parquet") and not name.startswith("."))
+
+    def _read(self, username, columns=None, filters=None):
+        files = self._files(username)
+        if not files:
+            return SCHEMA.empty_table().select(columns or SCHEMA.names)
+        return pq.read_table(files, columns=columns, filters=filters, memory_map=True, schema=SCHEMA)
+
+    def _write(self, username, table, prefix="part"):
+        path = self._partition(username)
+        os.makedirs(path, exist_ok=True)
+        name = f"{prefix}-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+        # Dot-prefixed while writing so readers skip the partial file
+        tmp_path = os.path.join(path, f".{name}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(path, name))
+
+    def _to_rows(self, username, table):
+        data = table.to_pydict()
+        return [
+            (username, loc, emo, round(float(conf), 2), ts.strftime(TIMESTAMP_FORMAT))
+            for loc, emo, conf, ts in zip(data["location"], data["emotion"], data["confidence"], data["timestamp"])
+        ]
+
+    def append(self, rows):
+        self._append(rows)
+
+    def _append(self, rows, prefix="part", compact=True):
+        by_user = {}
+        for username, location, emotion, confidence, timestamp in rows:
+            by_user.setdefault(username, []).append((location, emotion, confidence, timestamp))
+        for username, user_rows in by_user.items():
+            locations, emotions, confidences, timestamps = zip(*user_rows)
+            table = pa.table({
+                "location": pa.array(locations, pa.string()).dictionary_encode(),
+                "emotion": pa.array(emotions, pa.string()).dictionary_encode(),
+                "confidence": pa.array([float(c) for c in confidences], pa.float32()),
+                "timestamp": pa.array([datetime.strptime(str(ts), TIMESTAMP_FORMAT) for ts in timestamps],
+                                      pa.timestamp("s")),
+            }).cast(SCHEMA)
+            self._write(username, table, prefix=prefix)
+            if compact and len(self._files(username)) > self.compact_after:
+                self.compact(username)
+
+    def load_user(self, username):
+        table = self._read(username)
+        table = table.sort_by([("timestamp", "ascending")])
+        return self._to_rows(username, table)
+
+    def delete(self, username, timestamps):
+        stamps = pa.array([datetime.strptime(str(ts), TIMESTAMP_FORMAT) for ts in timestamps], pa.timestamp("s"))
+        with self._lock:
+            files = self._files(username)
+            if not files:
+                return
+            table = self._read(username)
+            keep = table.filter(pc.invert(pc.is_in(table["timestamp"], value_set=stamps)))
+            self._replace(username, files, keep)
+
+    def compact(self, username=None):
+        """Merge each partition's small files into one, sorted by timestamp"""
+        users = [username] if username is not None else self.users()
+        for user in users:
+            with self._lock:
+                files = self._files(user)
+                if len(files) < 2:
+                    continue
+                table = self._read(user).sort_by([("timestamp", "ascending")])
+                self._replace(user, files, table)
+
+    def _replace(self, username, old_files, table):
+        # Write the replacement first so a crash never leaves the user with nothing
+        if table.num_rows:
+            self._write(username, table.combine_chunks().unify_dictionaries(), prefix="compacted")
+        for path in old_files:
+            os.remove(path)
+
+    def is_empty(self):
+        return not self.users()
+
+    def is_migrated(self):
+        if os.path.exists(os.path.join(self.root, MIGRATED_MARKER)):
+            return True
+        # Stores written before the marker existed were migrated on first use;
+        # leftover legacy files mean an import was interrupted
+        return not self.is_empty() and not self._legacy_files()
+
+    def migrate_csv(self, path):
+        # Legacy rows go into their own files, so a retry first drops a partial import
+        with self._lock:
+            for legacy_path in self._legacy_files():
+                os.remove(legacy_path)
+        count = 0
+        for batch in read_csv_batches(path):
+            self._append(batch, prefix="legacy", compact=False)
+            count += len(batch)
+        self.mark_migrated()
+        return count
+
+    def mark_migrated(self):
+        open(os.path.join(self.root, MIGRATED_MARKER), "w").close()
+
+    def _legacy_files(self):
+        return [path for user in self.users() for path in self._files(user)
+                if os.path.basename(path).startswith("legacy-")]
+
+    def users(self):
+        return [unquote(name[len("user="):]) for name in sorted(os.listdir(self.root))
+                if name.startswith("user=")]
+
+    def count_sessions(self, username):
+        column = self._read(username, columns=["timestamp"])["timestamp"]
+        return len(pc.unique(column))
+
+    def _read_page(self, username, limit, offset):
+        stamps = pc.unique(self._read(username, columns=["timestamp"])["timestamp"])
+        stamps = pc.take(stamps, pc.array_sort_indices(stamps, order="descending"))
+        page = stamps[offset:offset + limit]
+        if len(page) == 0:
+            return None
+        table = self._read(username, filters=pc.is_in(pc.field("timestamp"), value_set=page))
+        return table.sort_by([("timestamp", "descending")])
+
+    def load_page(self, username, limit, offset=0):
+        table = self._read_page(username, limit, offset)
+        return [] if table is None else self._to_rows(username, table)
+
+    def load_page_frame(self, username, limit, offset=0):
+        # Straight from the typed table: categorical Location/Emotion, float32, datetime64
+        table = self._read_page(username, limit, offset)
+        if table is None:
+            table = SCHEMA.empty_table()
+        frame = table.to_pandas().rename(columns={"location": "Location", "emotion": "Emotion",
+                                                  "confidence": "Confidence"})
+        frame.insert(0, "username", username)
+        return frame[HISTORY_COLUMNS]
+
+    def emotion_counts(self, username):
+        counts = pc.value_counts(self._read(username, columns=["emotion"])["emotion"].combine_chunks())
+        return {str(item["values"]): item["counts"] for item in counts.to_pylist()}
+
+    def iter_all(self):
+        for username in self.users():
+            yield from self.load_user(username)
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+def downscale(img, max_edge):
+    """Shrink img so its longest edge is at most max_edge
+
+    Returns (resized, scale) where original coordinates = resized coordinates * scale.
+    The input is returned untouched when it is already small enough.
+    """
+    height, width = img.shape[:2]
+    longest = max(height, width)
+    if not max_edge or longest <= max_edge:
+        return img, 1.0
+    scale = longest / max_edge
+    size = (max(1, round(width / scale)), max(1, round(height / scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+def scale_region(region, scale, shape):
+    """Map an [x, y, w, h] box from a downscaled image back onto the original"""
+    height, width = shape[:2]
+    x, y, w, h = (int(round(v * scale)) for v in region)
+    x, y = min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+    return {"x": x, "y": y, "w": max(1, min(w, width - x)), "h": max(1, min(h, height - y))}
+
+def face_to_input(img, region, size=48):
+    """Crop a face from a BGR image into the emotion model's gray size x size input"""
+    crop = img[region["y"]:region["y"] + region["h"], region["x"]:region["x"] + region["w"]]
+    gray = crop if crop.ndim == 2 else cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+    return gray.astype(np.float32) / 255.0
+
+def encode_image(img, fmt=".jpg", quality=85):
+    """Encode a BGR image to JPEG or WebP bytes"""
+    if fmt == ".webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    ok, buffer = cv2.imencode(fmt, img, params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt}")
+    return buffer.tobytes()
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from .config import get_settings
+
+def emotion_matrix(user_df):
+    """Per-session emotion counts: one row per timestamp (input order), one column per emotion"""
+    # Fixed categories keep the column order stable and match the settings' label order
+    labels = get_settings().emotion_labels
+    known = user_df["Emotion"].isin(labels)
+    extra = sorted(set(user_df.loc[~known, "Emotion"].astype(str)))
+    emotions = pd.Categorical(user_df["Emotion"], categories=list(labels) + extra)
+    counts = pd.crosstab(user_df["timestamp"].to_numpy(), emotions)
+    counts = counts.loc[:, counts.sum() > 0]
+    counts.columns = counts.columns.astype(str)
+    counts.columns.name = None
+    counts.index.name = "timestamp"
+    return counts.reindex(pd.unique(user_df["timestamp"]))
+
+def summarize_sessions(user_df):
+    """Group history rows by timestamp into display rows plus the count matrix
+
+    Returns (grouped, counts) where grouped has Location, Emotion ("2 happy, 1 sad")
+    and timestamp columns, and counts is the matrix from emotion_matrix.
+    """
+    counts = emotion_matrix(user_df)
+
+    # Build the "N emotion" strings one emotion column at a time
+    text = pd.Series("", index=counts.index, dtype=object)
+    for label in counts.columns:
+        column = counts[label]
+        present = column.to_numpy() > 0
+        piece = column.astype(str) + f" {label}"
+        sep = np.where(present & (text != "").to_numpy(), ", ", "")
+        text = text + sep + piece.where(present, "")
+
+    locations = user_df.groupby("timestamp", sort=False)["Location"].first()
+    grouped = pd.DataFrame({
+        "Location": locations.reindex(counts.index).to_numpy(),
+        "Emotion": text.to_numpy(),
+        "timestamp": counts.index.to_numpy()
+    })
+    return grouped, counts
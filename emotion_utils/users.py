@@ -0,0 +1,101 @@
+import csv
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from .config import get_settings
+
+def hash_password(password, iterations=None, salt=None):
+    """Salted PBKDF2-SHA256, stored as pbkdf2_sha256$iterations$salt$hash
+
+    iterations defaults to Settings.password_iterations.
+    """
+    iterations = iterations or get_settings().password_iterations
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def verify_password(password, stored):
+    """Check a password against a PBKDF2 hash or a legacy unsalted SHA-256 hex digest"""
+    if stored.startswith("pbkdf2_sha256$"):
+        _, iterations, salt, expected = stored.split("$")
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+        return hmac.compare_digest(digest.hex(), expected)
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+def time_hash(iterations=None, rounds=5):
+    """Average seconds one hash_password call takes at the given work factor"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        hash_password("benchmark-password", iterations)
+    return (time.perf_counter() - start) / rounds
+
+class UserStore:
+    """users.csv with an in-memory username index, reloaded when the file changes"""
+
+    def __init__(self, path="users.csv", iterations=None):
+        self.path = path
+        self.iterations = iterations or get_settings().password_iterations
+        self._users = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._users, self._mtime = {}, None
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, newline="", encoding="utf-8") as f:
+            self._users = {row["username"]: row["password"] for row in csv.DictReader(f)}
+        self._mtime = mtime
+
+    def exists(self, username):
+        with self._lock:
+            self._refresh()
+            return username in self._users
+
+    def authenticate(self, username, password):
+        with self._lock:
+            self._refresh()
+            stored = self._users.get(username)
+        if stored is None or not verify_password(password, stored):
+            return False
+        if not stored.startswith("pbkdf2_sha256$"):
+            self._upgrade(username, password)
+        return True
+
+    def register(self, username, password):
+        """Add a user, returns False if the name is taken"""
+        hashed = hash_password(password, self.iterations)
+        with self._lock:
+            self._refresh()
+            if username in self._users:
+                return False
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if new_file:
+                    writer.writerow(["username", "password"])
+                writer.writerow([username, hashed])
+            self._users[username] = hashed
+            self._mtime = os.stat(self.path).st_mtime_ns
+        return True
+
+    def _upgrade(self, username, password):
+        """Rewrite a legacy SHA-256 entry with a salted hash after a successful login"""
+        hashed = hash_password(password, self.iterations)
+        with self._lock:
+            self._refresh()
+            self._users[username] = hashed
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["username", "password"])
+                writer.writerows(self._users.items())
+            os.replace(tmp_path, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
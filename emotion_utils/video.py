@@ -0,0 +1,74 @@
+import cv2
+
+def read_video_frames(source):
+    """Yield BGR frames from a video file path or webcam index"""
+    capture = cv2.VideoCapture(source)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+def video_fps(source, default=30.0):
+    """Frame rate reported by the container, or default if unknown"""
+    capture = cv2.VideoCapture(source)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return fps if fps and fps > 0 else default
+
+def box_iou(a, b):
+    """Intersection over union of two {x, y, w, h} boxes"""
+    x1, y1 = max(a["x"], b["x"]), max(a["y"], b["y"])
+    x2 = min(a["x"] + a["w"], b["x"] + b["w"])
+    y2 = min(a["y"] + a["h"], b["y"] + b["h"])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = a["w"] * a["h"] + b["w"] * b["h"] - inter
+    return inter / union if union > 0 else 0.0
+
+class FaceTracker:
+    """Greedy IoU tracker that keeps face identities between detections"""
+
+    def __init__(self, iou_threshold=0.3, max_missed=5):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = {}
+        self._next_id = 1
+
+    def update(self, boxes):
+        """Match boxes to tracks, returns a (track_id, is_new) pair per box"""
+        pairs = []
+        for t_id, track in self.tracks.items():
+            for b_idx, box in enumerate(boxes):
+                iou = box_iou(track["box"], box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, t_id, b_idx))
+        pairs.sort(reverse=True)
+
+        assigned = [None] * len(boxes)
+        matched = set()
+        for _, t_id, b_idx in pairs:
+            if t_id in matched or assigned[b_idx] is not None:
+                continue
+            matched.add(t_id)
+            assigned[b_idx] = (t_id, False)
+            self.tracks[t_id]["box"] = boxes[b_idx]
+            self.tracks[t_id]["missed"] = 0
+
+        for b_idx, box in enumerate(boxes):
+            if assigned[b_idx] is None:
+                t_id = self._next_id
+                self._next_id += 1
+                self.tracks[t_id] = {"box": box, "missed": 0, "emotion": None,
+                                     "confidence": None, "classified_at": None}
+                matched.add(t_id)
+                assigned[b_idx] = (t_id, True)
+
+        for t_id in list(self.tracks):
+            if t_id not in matched:
+                self.tracks[t_id]["missed"] += 1
+                if self.tracks[t_id]["missed"] > self.max_missed:
+                    del self.tracks[t_id]
+        return assigned
@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from .detector import EmotionDetector
+
+# Set in each worker process by _init_worker
+_worker_detector = None
+
+def _init_worker(detector_options):
+    global _worker_detector
+    _worker_detector = EmotionDetector(**detector_options)
+
+def _run_batch(images):
+    return _worker_detector.detect_emotions_batch(images)
+
+def _worker_ready():
+    # Runs after _init_worker, so returning means this process has its models loaded
+    return os.getpid()
+
+class InferencePool:
+    """Runs detection in worker processes that each load the models once"""
+
+    def __init__(self, workers=None, cache=None, max_pending=None, timeout=60, **detector_options):
+        """detector_options (backend, max_edge, classifier, ...) go to each worker's EmotionDetector"""
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cache = cache
+        self._settings = EmotionDetector(preload=False, **detector_options).settings_key()
+        # TensorFlow is not fork-safe, so workers always start fresh
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(detector_options,)
+        )
+        self._slots = threading.BoundedSemaphore(max_pending or self.workers * 2)
+
+    def submit(self, images):
+        """Queue a batch of BGR images, returns a Future of per-image detections
+
+        Raises TimeoutError when the queue stays full for longer than the timeout.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError("Inference pool is busy, try again shortly")
+        try:
+            future = self._executor.submit(_run_batch, images)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def warm_up(self):
+        """Start every worker now rather than on demand; returns the warm-up futures
+
+        Each worker loads its models in _init_worker as soon as it starts, so
+        spawning them all is enough. The first future completes once a worker
+        is ready.
+        """
+        # Submitted together, so no worker is idle yet and the executor spawns one per task
+        return [self._executor.submit(_worker_ready) for _ in range(self.workers)]
+
+    def detect_emotions_batch(self, images):
+        results = [None] * len(images)
+        keys = [None] * len(images)
+        if self.cache is not None:
+            keys = [self.cache.make_key(img, self._settings) for img in images]
+            results = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            fresh = self.submit([images[i] for i in missing]).result(timeout=self.timeout)
+            for i, detections in zip(missing, fresh):
+                results[i] = detections
+                if self.cache is not None:
+                    self.cache.put(keys[i], detections)
+        # Copies, so callers cannot change what the cache holds
+        return [[dict(det) for det in detections] for detections in results]
+
+    def detect_emotions(self, img):
+        """Same contract as EmotionDetector.detect_emotions, run in a worker"""
+        return self.detect_emotions_batch([img])[0]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)